@@ -178,6 +178,8 @@ KEYCLOAK_REALM = os.getenv("KEYCLOAK_REALM")
 OIDC_CLIENT_ID = os.getenv("KEYCLOAK_CLIENT_ID")
 OIDC_CLIENT_SECRET = os.getenv("KEYCLOAK_CLIENT_SECRET")
 OIDC_SCOPES = os.getenv("KEYCLOAK_SCOPES")
+KEYCLOAK_JWKS_REFRESH_INTERVAL = float(os.getenv("KEYCLOAK_JWKS_REFRESH_INTERVAL", 300))
+API_TOKEN_CACHE_SIZE = int(os.getenv("API_TOKEN_CACHE_SIZE", 10000))
 
 stripe.api_key = os.getenv("STRIPE_SERVER_KEY")
 stripe.api_version = "2024-04-10"
@@ -230,6 +232,18 @@ XFF_HEADER_REQUIRED = True
 
 RABBITMQ_RPC_URL = os.getenv("RABBITMQ_RPC_URL")
 
+TASK_EXECUTOR_WORKERS = int(os.getenv("TASK_EXECUTOR_WORKERS", 8))
+TASK_EXECUTOR_QUEUE_SIZE = int(os.getenv("TASK_EXECUTOR_QUEUE_SIZE", 256))
+TASK_EXECUTOR_SPOOL = os.getenv("TASK_EXECUTOR_SPOOL")
+CUSTOMER_SYNC_DEBOUNCE = float(os.getenv("CUSTOMER_SYNC_DEBOUNCE", 5))
+RPC_WORKERS = int(os.getenv("RPC_WORKERS", 8))
+RPC_PREFETCH = int(os.getenv("RPC_PREFETCH", 8))
+RPC_SHUTDOWN_TIMEOUT = float(os.getenv("RPC_SHUTDOWN_TIMEOUT", 30))
+RPC_STATS_INTERVAL = float(os.getenv("RPC_STATS_INTERVAL", 300))
+EXCHANGE_RATE_CACHE_TTL = float(os.getenv("EXCHANGE_RATE_CACHE_TTL", 60))
+PLAN_PRICING_CACHE_TTL = float(os.getenv("PLAN_PRICING_CACHE_TTL", 60))
+WEBHOOK_EVENT_TTL_DAYS = int(os.getenv("WEBHOOK_EVENT_TTL_DAYS", 30))
+
 STRIPE_CLIMATE = bool(os.getenv("STRIPE_CLIMATE"))
 STRIPE_CLIMATE_RATE = "0.01"
 
@@ -5,6 +5,7 @@ from . import models
 admin.site.register(models.Account)
 admin.site.register(models.AccountBillingAddress)
 admin.site.register(models.ExchangeRate)
+admin.site.register(models.ExchangeRateHistory)
 admin.site.register(models.SEPAMandate)
 admin.site.register(models.GCSEPAMandate)
 admin.site.register(models.BACSMandate)
@@ -18,6 +19,19 @@ admin.site.register(models.PADMandate)
 admin.site.register(models.KnownBankAccount)
 admin.site.register(models.KnownStripePaymentMethod)
 admin.site.register(models.AccountStripeVirtualUKBank)
+admin.site.register(models.AccountBalance)
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+    ordering = ('-received_at',)
+    list_display = (
+        'id', 'provider', 'event_id', 'state', 'attempts', 'duplicates', 'received_at'
+    )
+    list_filter = ('provider', 'state')
+    search_fields = ('event_id', 'ordering_key')
+
+
+admin.site.register(models.WebhookEvent, WebhookEventAdmin)
 
 
 class LedgerItemAdmin(admin.ModelAdmin):
@@ -0,0 +1,80 @@
+import queue
+import threading
+import pika
+import pika.exceptions
+
+
+class Publisher:
+    def __init__(self, parameters: pika.ConnectionParameters, pool_size=4):
+        self.parameters = parameters
+        self.pool = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self):
+        connection = pika.BlockingConnection(parameters=self.parameters)
+        channel = connection.channel()
+        channel.confirm_delivery()
+        return connection, channel
+
+    @staticmethod
+    def _close(connection):
+        try:
+            if connection.is_open:
+                connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+
+    def _checkout(self):
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    connection, channel = self.pool.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+
+                if connection.is_open and channel.is_open:
+                    return connection, channel
+                self._close(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _checkin(self, connection, channel, broken=False):
+        if broken:
+            self._close(connection)
+        else:
+            self.pool.put((connection, channel))
+        self.slots.release()
+
+    def publish(self, routing_key: str, body: bytes, properties: pika.BasicProperties = None, exchange=''):
+        for attempt in range(2):
+            connection, channel = self._checkout()
+            try:
+                # Service heartbeats and notice a dropped connection before publishing on it
+                connection.process_data_events(time_limit=0)
+                channel.basic_publish(
+                    exchange=exchange,
+                    routing_key=routing_key,
+                    properties=properties,
+                    body=body
+                )
+            except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+                self._checkin(connection, channel, broken=True)
+                if attempt:
+                    raise
+                continue
+            except BaseException:
+                self._checkin(connection, channel, broken=True)
+                raise
+
+            self._checkin(connection, channel)
+            return
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self.pool.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
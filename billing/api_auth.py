@@ -0,0 +1,158 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+import traceback
+import cryptography.exceptions
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+import django_keycloak_auth.clients
+import requests
+from django.conf import settings
+
+ALGORITHMS = {
+    "RS256": hashes.SHA256,
+    "RS384": hashes.SHA384,
+    "RS512": hashes.SHA512,
+}
+# Don't hammer keycloak when tokens arrive signed with a key ID we don't know
+MIN_KEY_REFRESH_INTERVAL = 30
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class UnverifiableToken(Exception):
+    pass
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def jwk_to_key(jwk: dict):
+    return rsa.RSAPublicNumbers(
+        e=int.from_bytes(b64decode(jwk["e"]), "big"),
+        n=int.from_bytes(b64decode(jwk["n"]), "big"),
+    ).public_key()
+
+
+class TokenVerifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claims = {}
+        self._keys = None
+        self._keys_fetched = None
+        self._rotator = None
+
+    @property
+    def issuer(self):
+        return f"{settings.KEYCLOAK_SERVER_URL.rstrip('/')}/realms/{settings.KEYCLOAK_REALM}"
+
+    def _fetch_keys(self):
+        r = requests.get(f"{self.issuer}/protocol/openid-connect/certs", timeout=5)
+        r.raise_for_status()
+        keys = {}
+        for jwk in r.json().get("keys", []):
+            if jwk.get("kty") == "RSA" and jwk.get("use", "sig") == "sig":
+                keys[jwk["kid"]] = jwk_to_key(jwk)
+
+        with self._lock:
+            self._keys = keys
+            self._keys_fetched = time.monotonic()
+
+    def _rotate(self):
+        while True:
+            time.sleep(settings.KEYCLOAK_JWKS_REFRESH_INTERVAL)
+            try:
+                self._fetch_keys()
+            except (requests.RequestException, ValueError, KeyError):
+                traceback.print_exc()
+
+    def _key(self, kid):
+        with self._lock:
+            keys, fetched = self._keys, self._keys_fetched
+        # Failed fetches are throttled too, so an unreachable keycloak doesn't add a timeout to every request
+        if (keys is None or kid not in keys) and (
+                fetched is None or time.monotonic() - fetched > MIN_KEY_REFRESH_INTERVAL
+        ):
+            try:
+                self._fetch_keys()
+            except (requests.RequestException, ValueError, KeyError):
+                traceback.print_exc()
+                with self._lock:
+                    self._keys_fetched = time.monotonic()
+
+        with self._lock:
+            if self._rotator is None and self._keys is not None:
+                self._rotator = threading.Thread(target=self._rotate, daemon=True)
+                self._rotator.start()
+            return (self._keys or {}).get(kid)
+
+    def verify_locally(self, token: str) -> dict:
+        try:
+            header_b64, payload_b64, signature_b64 = token.split(".")
+            header = json.loads(b64decode(header_b64))
+            payload = json.loads(b64decode(payload_b64))
+            signature = b64decode(signature_b64)
+        except (ValueError, TypeError):
+            raise InvalidToken()
+        if not isinstance(header, dict) or not isinstance(payload, dict):
+            raise InvalidToken()
+
+        kid = header.get("kid")
+        if kid is not None and not isinstance(kid, str):
+            raise InvalidToken()
+        hash_alg = ALGORITHMS.get(header.get("alg")) if isinstance(header.get("alg"), str) else None
+        if not hash_alg:
+            raise UnverifiableToken()
+        key = self._key(kid)
+        if not key:
+            raise UnverifiableToken()
+
+        try:
+            key.verify(signature, f"{header_b64}.{payload_b64}".encode(), padding.PKCS1v15(), hash_alg())
+        except cryptography.exceptions.InvalidSignature:
+            raise InvalidToken()
+
+        now = time.time()
+        if not isinstance(payload.get("exp"), (int, float)) or payload["exp"] <= now:
+            raise InvalidToken()
+        if isinstance(payload.get("nbf"), (int, float)) and payload["nbf"] > now:
+            raise InvalidToken()
+        if payload.get("iss") != self.issuer:
+            raise UnverifiableToken()
+
+        return payload
+
+    def _cache(self, token_hash: str, claims: dict):
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+
+        with self._lock:
+            if len(self._claims) >= settings.API_TOKEN_CACHE_SIZE:
+                now = time.time()
+                self._claims = {k: v for k, v in self._claims.items() if v[1] > now}
+                while len(self._claims) >= settings.API_TOKEN_CACHE_SIZE:
+                    self._claims.pop(next(iter(self._claims)))
+            self._claims[token_hash] = (claims, exp)
+
+    def verify(self, token: str) -> dict:
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        cached = self._claims.get(token_hash)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        try:
+            claims = self.verify_locally(token)
+        except UnverifiableToken:
+            claims = django_keycloak_auth.clients.verify_token(token)
+
+        self._cache(token_hash, claims)
+        return claims
+
+
+verifier = TokenVerifier()
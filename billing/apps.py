@@ -1,9 +1,11 @@
+import pika
 import plaid
 import zeep
 import gocardless_pro
 from django.conf import settings
 from django.apps import AppConfig
 import as207960_utils.rpc
+from . import amqp, executor
 
 # plaid_client = plaid.Client(
 #     client_id=settings.PLAID_CLIENT_ID,
@@ -15,7 +17,16 @@ gocardless_client = gocardless_pro.Client(access_token=settings.GOCARDLESS_TOKEN
 vies_client = zeep.Client("https://ec.europa.eu/taxation_customs/vies/checkVatService.wsdl")
 ch_uid_client = zeep.Client("https://www.uid-wse.admin.ch/V5.0/PublicServices.svc?wsdl")
 rpc_client = as207960_utils.rpc.RpcClient()
+amqp_publisher = amqp.Publisher(pika.URLParameters(settings.RABBITMQ_RPC_URL))
+task_executor = executor.Executor(
+    max_workers=settings.TASK_EXECUTOR_WORKERS,
+    max_queue=settings.TASK_EXECUTOR_QUEUE_SIZE,
+    spool_path=settings.TASK_EXECUTOR_SPOOL,
+)
 
 
 class BillingConfig(AppConfig):
     name = 'billing'
+
+    def ready(self):
+        from . import cf, nb  # noqa: F401
@@ -0,0 +1,90 @@
+import re
+import typing
+from . import models
+
+REF_LENGTH = 12
+REF_ALPHABET = "0123456789ABCDEF"
+LOOKUP_BATCH_SIZE = 1000
+
+# Characters customers commonly type in place of the hex digits we issue
+LOOKALIKES = str.maketrans({
+    "O": "0",
+    "Q": "0",
+    "I": "1",
+    "L": "1",
+    "Z": "2",
+    "S": "5",
+    "G": "6",
+    "T": "7",
+})
+
+_non_alnum = re.compile(r"[^0-9A-Z]")
+_ref_chars = re.compile(f"^[{REF_ALPHABET}]+$")
+
+
+def normalise(ref: str) -> str:
+    return _non_alnum.sub("", ref.upper())
+
+
+def windows(ref: str, length=REF_LENGTH) -> typing.List[str]:
+    return list(dict.fromkeys(ref[i:i + length] for i in range(len(ref) - length + 1)))
+
+
+def typo_variants(window: str) -> typing.Iterator[str]:
+    for i in range(len(window)):
+        for c in REF_ALPHABET:
+            if c != window[i]:
+                yield window[:i] + c + window[i + 1:]
+    for i in range(len(window) - 1):
+        if window[i] != window[i + 1]:
+            yield window[:i] + window[i + 1] + window[i] + window[i + 2:]
+
+
+class ReferenceMatcher:
+    def __init__(self, lookup: typing.Callable[[typing.List[str]], dict]):
+        self.lookup = lookup
+
+    def match(self, ref: str, fuzzy=True):
+        ref = normalise(ref)
+        if len(ref) < REF_LENGTH:
+            return None
+
+        exact = windows(ref)
+        found = self.lookup(exact)
+        for window in exact:
+            if window in found:
+                return found[window]
+
+        if not fuzzy:
+            return None
+
+        candidates = {}
+        for window in windows(ref.translate(LOOKALIKES)):
+            if not _ref_chars.match(window):
+                continue
+            candidates.setdefault(window, None)
+            for variant in typo_variants(window):
+                candidates.setdefault(variant, None)
+        candidates = list(candidates.keys())
+        found = self.lookup(candidates)
+
+        # A typo'd reference is only trusted if it points at exactly one pending item
+        matches = set(found.values())
+        if len(matches) == 1:
+            return matches.pop()
+        return None
+
+
+def pending_bank_transfers(refs: typing.List[str]) -> typing.Dict[str, "models.LedgerItem"]:
+    found = {}
+    for i in range(0, len(refs), LOOKUP_BATCH_SIZE):
+        for item in models.LedgerItem.objects.filter(
+                type=models.LedgerItem.TYPE_BACS,
+                state=models.LedgerItem.STATE_PENDING,
+                type_id__in=refs[i:i + LOOKUP_BATCH_SIZE],
+        ):
+            found.setdefault(item.type_id, item)
+    return found
+
+
+matcher = ReferenceMatcher(pending_bank_transfers)
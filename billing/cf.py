@@ -3,9 +3,9 @@ import dataclasses
 import typing
 import requests
 from django.conf import settings
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import pre_delete
 from django.dispatch import receiver
-from . import models, tasks
+from . import models, customer_sync
 
 class CloudflareResult(enum.Enum):
     SUCCESS = enum.auto()
@@ -86,7 +86,7 @@ def delete_cloudflare_account(account: models.Account):
     account.cloudflare_account_id = None
     account.save()
 
-@tasks.as_thread
+@customer_sync.provider("cloudflare")
 def update_cloudflare_account_name(account: models.Account):
     if not account.cloudflare_account_id:
         return
@@ -108,15 +108,6 @@ def update_cloudflare_account_name(account: models.Account):
 def account_delete_handler(instance: models.Account, **kwargs):
     delete_cloudflare_account(instance)
 
-@receiver(post_save, sender=models.Account)
-def send_charge_state_notif_receiver(instance: models.Account, **kwargs):
-    update_cloudflare_account_name(instance)
-
-@receiver(post_save, sender=models.AccountBillingAddress)
-def send_charge_state_notif_receiver(instance: models.AccountBillingAddress, **kwargs):
-    if instance.account.billing_address == instance:
-        update_cloudflare_account_name(instance.account)
-
 
 def add_cloudflare_user(account: models.Account):
     if not account.cloudflare_account_id:
@@ -0,0 +1,53 @@
+import threading
+import traceback
+import django.apps
+from django.conf import settings
+from . import apps
+
+providers = {}
+pending = {}
+lock = threading.Lock()
+timer = None
+
+
+def provider(name):
+    def wrapper(fun):
+        providers[name] = fun
+        return fun
+
+    return wrapper
+
+
+def mark_dirty(account_id, names=None):
+    global timer
+
+    with lock:
+        pending.setdefault(str(account_id), set()).update(names if names is not None else providers.keys())
+        if timer is None:
+            timer = threading.Timer(settings.CUSTOMER_SYNC_DEBOUNCE, flush)
+            timer.start()
+
+
+def flush():
+    global timer
+
+    with lock:
+        batch = dict(pending)
+        pending.clear()
+        timer = None
+
+    for account_id, names in batch.items():
+        apps.task_executor.submit(sync_account, account_id, sorted(names))
+
+
+def sync_account(account_id, names):
+    account_model = django.apps.apps.get_model("billing", "Account")
+    account = account_model.objects.select_related('user', 'billing_address').filter(id=account_id).first()
+    if not account:
+        return
+
+    for name in names:
+        try:
+            providers[name](account)
+        except Exception:
+            traceback.print_exc()
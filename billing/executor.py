@@ -0,0 +1,181 @@
+import atexit
+import importlib
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import django.apps
+from django import db
+
+
+class ExecutorShutdown(Exception):
+    pass
+
+
+class Executor:
+    def __init__(self, max_workers=8, max_queue=256, spool_path=None):
+        self.max_workers = max_workers
+        self.spool_path = spool_path
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.workers = []
+        self.lock = threading.Lock()
+        self.accepting = True
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.high_water = 0
+        self._registered = False
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "high_water": self.high_water,
+            "workers": len(self.workers),
+        }
+
+    def _start(self):
+        restore = False
+        with self.lock:
+            if not self._registered:
+                self._registered = True
+                restore = True
+                atexit.register(self.drain)
+            while len(self.workers) < self.max_workers:
+                t = threading.Thread(target=self._run, daemon=True)
+                t.start()
+                self.workers.append(t)
+
+        if restore:
+            # Restoring can block on a full queue and touches the database, so keep it out of the submitting thread
+            threading.Thread(target=self._restore, daemon=True).start()
+
+    def submit(self, fun, *args, **kwargs):
+        if not self.accepting:
+            raise ExecutorShutdown()
+        if len(self.workers) < self.max_workers:
+            self._start()
+
+        # Blocks the caller while the queue is full, so producers slow down instead of piling up work
+        self.queue.put((fun, args, kwargs))
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+
+            fun, args, kwargs = job
+            with self.lock:
+                self.active += 1
+            db.close_old_connections()
+            try:
+                fun(*args, **kwargs)
+            except Exception:
+                traceback.print_exc()
+                with self.lock:
+                    self.failed += 1
+            else:
+                with self.lock:
+                    self.completed += 1
+            finally:
+                db.close_old_connections()
+                with self.lock:
+                    self.active -= 1
+                self.queue.task_done()
+
+    def drain(self, timeout=30):
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+        pending = []
+        while True:
+            try:
+                pending.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self._spool(pending)
+
+        for _ in self.workers:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, db.models.Model):
+            return {"__model__": value._meta.label_lower, "pk": str(value.pk)}
+        json.dumps(value)
+        return value
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, dict) and "__model__" in value:
+            model = django.apps.apps.get_model(value["__model__"])
+            return model.objects.filter(pk=value["pk"]).first()
+        return value
+
+    def _spool(self, jobs):
+        if not jobs:
+            return
+        if not self.spool_path:
+            print(f"Dropping {len(jobs)} background jobs on shutdown", flush=True)
+            return
+
+        spooled = []
+        for fun, args, kwargs in jobs:
+            try:
+                spooled.append({
+                    "fun": f"{fun.__module__}:{fun.__qualname__}",
+                    "args": [self._encode(a) for a in args],
+                    "kwargs": {k: self._encode(v) for k, v in kwargs.items()},
+                })
+            except (TypeError, AttributeError):
+                print(f"Unable to persist background job {fun!r}", flush=True)
+
+        with open(self.spool_path, "a") as f:
+            for job in spooled:
+                f.write(json.dumps(job) + "\n")
+        print(f"Persisted {len(spooled)} background jobs to {self.spool_path}", flush=True)
+
+    def _restore(self):
+        if not self.spool_path:
+            return
+
+        # Every process shares the spool, so whichever manages to move it away first restores it
+        restore_path = f"{self.spool_path}.{os.getpid()}.restoring"
+        try:
+            os.replace(self.spool_path, restore_path)
+        except FileNotFoundError:
+            return
+
+        restored = 0
+        with open(restore_path) as f:
+            for line in f:
+                try:
+                    job = json.loads(line)
+                    module_name, qualname = job["fun"].split(":", 1)
+                    fun = importlib.import_module(module_name)
+                    for part in qualname.split("."):
+                        fun = getattr(fun, part)
+                    fun = getattr(fun, "run", fun)
+                    args = [self._decode(a) for a in job["args"]]
+                    kwargs = {k: self._decode(v) for k, v in job["kwargs"].items()}
+                except Exception:
+                    traceback.print_exc()
+                    print(f"Unable to restore background job {line.strip()}", flush=True)
+                    continue
+                self.queue.put((fun, args, kwargs))
+                restored += 1
+        db.connections.close_all()
+        os.remove(restore_path)
+        print(f"Restored {restored} background jobs from {self.spool_path}", flush=True)
@@ -1,24 +1,50 @@
+import decimal
+import time
 from django.core.management.base import BaseCommand
+from django.db.models import Sum
 from django.template.loader import render_to_string
 from billing import models, tasks, emails
 
+RECONCILE_THRESHOLD = decimal.Decimal(-1)
+
 
 class Command(BaseCommand):
     help = 'Attempt to bring all account balances back above negative'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List the accounts that would be charged")
+
     def handle(self, *args, **options):
-        for account in models.Account.objects.all():
-            if account.processing_and_completed_balance < -1:
-                charge = 0 - account.processing_and_completed_balance
-                try:
-                    tasks.charge_account(account, charge, "Balance reconciliation", "")
-                except tasks.ChargeError as e:
-                    print(f"Failed to bill account {account.user.username}: {e.message}")
-                    emails.send_email({
-                        "subject": "Billing reconciliation failed",
-                        "content": render_to_string("billing_email/billing_reconcile_fail.html", {
-                            "reason": e.message
-                        })
-                    }, user=account.user)
+        start = time.monotonic()
+
+        balances = dict(
+            models.AccountBalance.objects.filter(
+                bucket__in=(models.LedgerItem.STATE_COMPLETED, models.LedgerItem.STATE_PROCESSING)
+            ).values('account_id').annotate(balance=Sum('amount')).filter(balance__lt=RECONCILE_THRESHOLD)
+            .order_by().values_list('account_id', 'balance')
+        )
+        accounts = models.Account.objects.filter(id__in=balances.keys()).select_related('user')
+        selected = time.monotonic()
+
+        charged = 0
+        for account in accounts:
+            charge = 0 - balances[account.id].quantize(decimal.Decimal('1.00'))
+            if options['dry_run']:
+                print(f"Would charge account {account.user.username}: {charge} GBP")
+                continue
+
+            try:
+                tasks.charge_account(account, charge, "Balance reconciliation", "")
+            except tasks.ChargeError as e:
+                print(f"Failed to bill account {account.user.username}: {e.message}")
+                emails.send_email({
+                    "subject": "Billing reconciliation failed",
+                    "content": render_to_string("billing_email/billing_reconcile_fail.html", {
+                        "reason": e.message
+                    })
+                }, user=account.user)
             else:
-                print(f"Not charging account {account.user.username}: balance not negative enough")
+                charged += 1
+
+        print(f"{len(balances)} accounts below {RECONCILE_THRESHOLD} GBP, {charged} charged; "
+              f"selected in {selected - start:.2f}s, total {time.monotonic() - start:.2f}s")
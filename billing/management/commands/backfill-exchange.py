@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+import xml.etree.ElementTree
+import requests
+import datetime
+import decimal
+from billing import models
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = 'Backfills the exchange rate history from the ECB historical feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', type=str, default="https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.xml",
+            help="ECB historical reference rates XML"
+        )
+
+    def handle(self, *args, **options):
+        r = requests.get(options['url'], stream=True)
+        if r.status_code != 200:
+            raise CommandError(f"Error getting exchange rates: {r.text}")
+        r.raw.decode_content = True
+
+        namespace = "{http://www.ecb.int/vocabulary/2002-08-01/eurofxref}"
+        batch = []
+        days = 0
+        inserted = 0
+
+        def flush():
+            nonlocal inserted
+            with transaction.atomic():
+                models.ExchangeRateHistory.objects.bulk_create(batch, ignore_conflicts=True)
+            inserted += len(batch)
+            batch.clear()
+
+        try:
+            for _, elem in xml.etree.ElementTree.iterparse(r.raw, events=("end",)):
+                if elem.tag != f"{namespace}Cube" or "time" not in elem.attrib:
+                    continue
+
+                date = datetime.datetime.strptime(elem.attrib["time"], "%Y-%m-%d").date()
+                batch.append(models.ExchangeRateHistory(date=date, currency="EUR", rate=decimal.Decimal("1.0")))
+                for rate in elem:
+                    batch.append(models.ExchangeRateHistory(
+                        date=date, currency=rate.attrib["currency"], rate=decimal.Decimal(rate.attrib["rate"])
+                    ))
+                days += 1
+                elem.clear()
+
+                if len(batch) >= BATCH_SIZE:
+                    flush()
+        except xml.etree.ElementTree.ParseError as e:
+            raise CommandError(f"Error decoding XML: {str(e)}")
+
+        if batch:
+            flush()
+
+        models.ExchangeRate.bump_version()
+        print(f"Processed {inserted} rates over {days} days")
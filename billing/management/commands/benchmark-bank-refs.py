@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+import random
+import secrets
+import time
+from billing import bank_refs
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks bank transfer reference matching against a synthetic set of pending references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refs', type=int, default=100000, help="Number of pending references")
+        parser.add_argument('--queries', type=int, default=1000, help="Number of incoming payments to match")
+        parser.add_argument('--naive-queries', type=int, default=100, help="Number of payments to match by scanning")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        refs = [secrets.token_hex(6).upper() for _ in range(options['refs'])]
+        index = {ref: ref for ref in refs}
+        matcher = bank_refs.ReferenceMatcher(lambda candidates: {c: index[c] for c in candidates if c in index})
+
+        def typo(ref):
+            i = rng.randrange(len(ref))
+            return ref[:i] + rng.choice([c for c in bank_refs.REF_ALPHABET if c != ref[i]]) + ref[i + 1:]
+
+        queries = []
+        for _ in range(options['queries']):
+            ref = rng.choice(refs)
+            kind = rng.choice(("exact", "spaced", "typo", "miss"))
+            if kind == "exact":
+                queries.append((f"INVOICE {ref} THANKS", ref))
+            elif kind == "spaced":
+                queries.append((f"{ref[:4]} {ref[4:8]}-{ref[8:]}".lower(), ref))
+            elif kind == "typo":
+                queries.append((f"PAYMENT {typo(ref)}", ref))
+            else:
+                queries.append((f"RENT {secrets.token_hex(6).upper()}", None))
+
+        start = time.perf_counter()
+        correct = 0
+        for text, expected in queries:
+            if matcher.match(text) == expected:
+                correct += 1
+        elapsed = time.perf_counter() - start
+        print(f"Indexed: {len(queries)} payments over {len(refs)} references in {elapsed * 1000:.1f}ms "
+              f"({elapsed / len(queries) * 1e6:.1f}us/payment), {correct} matched as expected")
+
+        naive_queries = queries[:options['naive_queries']]
+        start = time.perf_counter()
+        correct = 0
+        for text, expected in naive_queries:
+            normalised_ref = text.upper().replace(" ", "").replace("\n", "")
+            found = None
+            for ref in refs:
+                if ref in normalised_ref:
+                    found = ref
+                    break
+            if found == expected:
+                correct += 1
+        elapsed = time.perf_counter() - start
+        print(f"Scan: {len(naive_queries)} payments over {len(refs)} references in {elapsed * 1000:.1f}ms "
+              f"({elapsed / len(naive_queries) * 1e6:.1f}us/payment), {correct} matched as expected")
@@ -0,0 +1,22 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from billing import models
+
+
+class Command(BaseCommand):
+    help = 'Removes processed webhook events older than the retention window and reports duplicate deliveries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl-days', type=int, default=settings.WEBHOOK_EVENT_TTL_DAYS,
+            help="Keep processed events for this many days"
+        )
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['ttl_days'])
+        deleted = models.WebhookEvent.compact(before)
+
+        print(f"Compacted {deleted} processed webhook events older than {before}")
+        print(f"{models.WebhookEvent.suppressed_duplicates()} duplicate webhook deliveries suppressed")
@@ -1,32 +1,49 @@
 from django.core.management.base import BaseCommand
 import datetime
+import time
+from django.db.models import Q
 from django.utils import timezone
-from billing import models
-import django.core.exceptions
+from billing import models, tasks
 
 FAIL_TIME = datetime.timedelta(days=7)
+BATCH_SIZE = 500
 
 
 class Command(BaseCommand):
     help = 'Fails all old pending charges'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List the charges that would be failed")
+
     def handle(self, *args, **options):
+        start = time.monotonic()
         now = timezone.now()
         fail_threshold = now - FAIL_TIME
 
-        for ledger_item in models.LedgerItem.objects.filter(
+        stale_ids = list(models.LedgerItem.objects.filter(
             type=models.LedgerItem.TYPE_CHARGE,
             state=models.LedgerItem.STATE_PENDING,
             last_state_change_timestamp__lt=fail_threshold
-        ):
-            try:
-                charge_state = ledger_item.charge_state
-            except django.core.exceptions.ObjectDoesNotExist:
-                charge_state = None
-
-            if charge_state and not charge_state.last_error:
-                charge_state.last_error = "Payment timed out"
-                charge_state.save()
-
-            ledger_item.state = models.LedgerItem.STATE_FAILED
-            ledger_item.save()
+        ).order_by('last_state_change_timestamp').values_list('id', flat=True))
+        selected = time.monotonic()
+
+        if options['dry_run']:
+            for ledger_item in models.LedgerItem.objects.filter(id__in=stale_ids).select_related('account__user'):
+                print(f"Would fail {ledger_item.id} ({ledger_item.descriptor}) "
+                      f"for {ledger_item.account.user.username if ledger_item.account else 'no account'}")
+        else:
+            for i in range(0, len(stale_ids), BATCH_SIZE):
+                batch = stale_ids[i:i + BATCH_SIZE]
+                models.ChargeState.objects.filter(
+                    Q(last_error__isnull=True) | Q(last_error=""), ledger_item_id__in=batch
+                ).update(last_error="Payment timed out")
+
+                # Balances are updated for the whole batch at once, notifications still go out per charge
+                failed = models.LedgerItem.objects.filter(
+                    id__in=batch, state=models.LedgerItem.STATE_PENDING
+                ).set_state(models.LedgerItem.STATE_FAILED)
+                for ledger_item in failed:
+                    tasks.try_update_charge_state(instance=ledger_item)
+
+        print(f"{'Found' if options['dry_run'] else 'Failed'} {len(stale_ids)} stale charges; "
+              f"selected in {selected - start:.2f}s, total {time.monotonic() - start:.2f}s")
@@ -0,0 +1,45 @@
+import decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from billing import models
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds account balance snapshots from the ledger and reports any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            totals = models.AccountBalance.ledger_totals()
+            snapshots = {
+                (b.account_id, b.bucket): b for b in models.AccountBalance.objects.select_for_update()
+            }
+
+            drifted = 0
+            for key in set(totals.keys()) | set(snapshots.keys()):
+                expected = totals.get(key) or decimal.Decimal(0)
+                snapshot = snapshots.get(key)
+                actual = snapshot.amount if snapshot else decimal.Decimal(0)
+                if expected == actual:
+                    continue
+
+                drifted += 1
+                account_id, bucket = key
+                print(f"Account {account_id} bucket {bucket}: snapshot {actual}, ledger {expected}, "
+                      f"drift {actual - expected}")
+
+                if options['dry_run']:
+                    continue
+
+                if snapshot:
+                    snapshot.amount = expected
+                    snapshot.save()
+                else:
+                    models.AccountBalance.objects.create(account_id=account_id, bucket=bucket, amount=expected)
+
+        if options['dry_run']:
+            print(f"{drifted} balance buckets drifted")
+        else:
+            print(f"{drifted} balance buckets drifted and were rebuilt")
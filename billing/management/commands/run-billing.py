@@ -1,4 +1,10 @@
+import collections
+import concurrent.futures
+import threading
+import time
+import traceback
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
 from django.utils import timezone
 from billing import models, tasks
 
@@ -6,59 +12,36 @@ from billing import models, tasks
 class Command(BaseCommand):
     help = 'Runs the billing system background tasks once'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Number of accounts to bill concurrently")
+
     def handle(self, *args, **options):
         now = timezone.now()
-        plans = models.RecurringPlan.objects.all()
-        for plan in plans:
-            billing_interval = plan.billing_interval
-            for subscription in plan.subscription_set.all():
-                if subscription.state == subscription.STATE_PENDING:
-                    print(f"Not charging subscription {subscription.id}: subscription pending")
-                    continue
-                if subscription.state == subscription.STATE_CANCELLED:
-                    print(f"Not charging subscription {subscription.id}: subscription cancelled")
-                    continue
-
-                next_bill = subscription.last_billed + billing_interval
-                if next_bill > now:
-                    print(f"Not charging subscription {subscription.id}: not due for charge yet")
-                    continue
-
-                charge = plan.calculate_charge(subscription.usage_in_period)
-
-                subscription_charge = models.SubscriptionCharge(
-                    subscription=subscription,
-                    timestamp=now,
-                    last_bill_attempted=now,
-                    amount=charge,
-                )
+        self.stats = collections.Counter()
+        self.stats_lock = threading.Lock()
+        start = time.monotonic()
 
-                try:
-                    charge_state = tasks.charge_account(
-                        subscription.account, charge, plan.name, f"sb_{subscription.id}",
-                        can_reject=True, off_session=True, supports_delayed=True, mail=False
-                    )
-                except (tasks.ChargeError, tasks.ChargeStateRequiresActionError) as e:
-                    ledger_item = e.charge_state.ledger_item
-                else:
-                    ledger_item = charge_state.ledger_item
+        due_subscriptions = models.Subscription.objects.filter(
+            state__in=(models.Subscription.STATE_ACTIVE, models.Subscription.STATE_PAST_DUE),
+            next_bill__lte=now,
+        ).order_by('next_bill').values_list('account_id', 'id')
+        accounts = collections.defaultdict(list)
+        for account_id, subscription_id in due_subscriptions:
+            accounts[account_id].append(subscription_id)
 
-                subscription_charge.last_ledger_item = ledger_item
-                subscription_charge.save()
-                ledger_item.subscription_charge = subscription_charge
-                ledger_item.save(mail=True, force_mail=True)
-
-                subscription.last_billed = now
-                subscription.save()
-
-                print(f"Charged subscription {subscription.id}")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [
+                executor.submit(self.bill_account, subscription_ids, now) for subscription_ids in accounts.values()
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
 
         retry_time = now - tasks.SUBSCRIPTION_RETRY_INTERVAL
         retry_charges = models.SubscriptionCharge.objects.filter(
             subscription__state__in=(models.Subscription.STATE_PAST_DUE, models.Subscription.STATE_ACTIVE),
             last_ledger_item__state=models.LedgerItem.STATE_FAILED,
             last_bill_attempted__lte=retry_time
-        )
+        ).select_related('subscription__plan', 'subscription__account')
         for subscription_charge in retry_charges:
             if subscription_charge.failed_bill_attempts < tasks.SUBSCRIPTION_RETRY_ATTEMPTS:
                 try:
@@ -77,5 +60,77 @@ class Command(BaseCommand):
                     charge_state.ledger_item.save(mail=True, force_mail=True)
                 subscription_charge.last_bill_attempted = now
                 subscription_charge.save()
+                self.stats["retried"] += 1
 
                 print(f"Retry charged subscription {subscription_charge.subscription.id}")
+
+        elapsed = time.monotonic() - start
+        billed = self.stats["charged"] + self.stats["failed"]
+        print(f"Billed {billed} subscriptions across {len(accounts)} accounts in {elapsed:.1f}s "
+              f"({billed / elapsed if elapsed else 0:.1f}/s): {self.stats['charged']} charged, "
+              f"{self.stats['failed']} failed, {self.stats['skipped']} skipped, {self.stats['errored']} errored, "
+              f"{self.stats['retried']} retried")
+
+    def record(self, outcome):
+        with self.stats_lock:
+            self.stats[outcome] += 1
+
+    def bill_account(self, subscription_ids, now):
+        try:
+            for subscription_id in subscription_ids:
+                try:
+                    self.record(self.bill_subscription(subscription_id, now))
+                except Exception:
+                    traceback.print_exc()
+                    print(f"Error charging subscription {subscription_id}")
+                    self.record("errored")
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def bill_subscription(subscription_id, now):
+        # The period is claimed under the lock before charging, so if anything fails after the customer has been
+        # charged the subscription isn't picked up and billed again by the next run
+        with transaction.atomic():
+            subscription = models.Subscription.objects.select_for_update() \
+                .select_related('plan', 'account').get(id=subscription_id)
+            if subscription.state not in (models.Subscription.STATE_ACTIVE, models.Subscription.STATE_PAST_DUE):
+                print(f"Not charging subscription {subscription.id}: subscription no longer active")
+                return "skipped"
+            if subscription.next_bill > now:
+                print(f"Not charging subscription {subscription.id}: already charged")
+                return "skipped"
+
+            plan = subscription.plan
+            charge = plan.calculate_charge(subscription.usage_in_period)
+
+            subscription.last_billed = now
+            subscription.save()
+
+        outcome = "charged"
+        try:
+            charge_state = tasks.charge_account(
+                subscription.account, charge, plan.name, f"sb_{subscription.id}",
+                can_reject=True, off_session=True, supports_delayed=True, mail=False
+            )
+        except (tasks.ChargeError, tasks.ChargeStateRequiresActionError) as e:
+            ledger_item = e.charge_state.ledger_item
+            outcome = "failed"
+        else:
+            ledger_item = charge_state.ledger_item
+
+        subscription_charge = models.SubscriptionCharge(
+            subscription=subscription,
+            timestamp=now,
+            last_bill_attempted=now,
+            amount=charge,
+            last_ledger_item=ledger_item,
+        )
+        with transaction.atomic():
+            subscription_charge.save()
+            models.LedgerItem.objects.filter(pk=ledger_item.pk).update(subscription_charge=subscription_charge)
+        ledger_item.subscription_charge = subscription_charge
+        tasks.try_update_charge_state(ledger_item, mail=True, force_mail=True)
+
+        print(f"Charged subscription {subscription.id}")
+        return outcome
@@ -2,122 +2,197 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.db import transaction
 from django.contrib.auth import get_user_model
-import pika.exceptions
+from django import db
+import aio_pika
+import aio_pika.abc
+import aio_pika.exceptions
+import asyncio
+import bisect
+import collections
+import concurrent.futures
 import ipaddress
-import threading
 import decimal
+import signal
 import time
 import traceback
-import sys
-import functools
 from billing import models, tasks, vat, apps, cf, nb
 import billing.proto.billing_pb2
 import billing.proto.geoip_pb2
 
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.failed = 0
+
+    def observe(self, seconds: float, failed=False):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if failed:
+            self.failed += 1
+
+    def quantile(self, q: float) -> str:
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return f"{bound * 1000:g}ms"
+        return f">{self.buckets[-1] * 1000:g}ms"
+
+    def summary(self) -> str:
+        if not self.count:
+            return "no calls"
+        return (
+            f"{self.count} calls, {self.failed} failed, mean {self.total / self.count * 1000:.1f}ms, "
+            f"p50 <= {self.quantile(0.5)}, p95 <= {self.quantile(0.95)}, p99 <= {self.quantile(0.99)}"
+        )
+
 
 class Command(BaseCommand):
     help = 'Runs the RPC server on rabbitmq'
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.queue = {}
-        self.parameters = pika.URLParameters(settings.RABBITMQ_RPC_URL)
-        self.connection = None
+        self.executor = None
         self.channel = None
+        self.in_flight = set()
+        self.latency = collections.defaultdict(LatencyHistogram)
 
         self.commands = {
             "convert_currency": self.convert_currency,
             "charge_user": self.charge_user,
+            "charge_users": self.charge_users,
             "cloudflare_account": self.cloudflare_account,
             "netbox_account": self.netbox_account,
+            "log_usage": self.log_usage,
         }
 
-    def setup_connection(self):
-        self.connection = pika.BlockingConnection(parameters=self.parameters)
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(queue='billing_rpc', durable=True)
-        self.channel.basic_qos(prefetch_count=5, global_qos=True)
-        self.channel.basic_consume(queue='billing_rpc', on_message_callback=self.callback, auto_ack=False)
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.RPC_WORKERS,
+                            help="Threads to run requests on")
+        parser.add_argument('--prefetch', type=int, default=settings.RPC_PREFETCH,
+                            help="Unacknowledged messages to accept from rabbitmq at once")
+        parser.add_argument('--shutdown-timeout', type=float, default=settings.RPC_SHUTDOWN_TIMEOUT,
+                            help="Seconds to wait for in-flight requests on shutdown")
+        parser.add_argument('--stats-interval', type=float, default=settings.RPC_STATS_INTERVAL,
+                            help="Seconds between printing latency statistics")
 
     def handle(self, *args, **options):
-        self.setup_connection()
-
-        print("RPC handler now running", flush=True)
-
-        try:
-            while True:
-                try:
-                    while True:
-                        try:
-                            self.connection.process_data_events()
-                        except pika.exceptions.AMQPConnectionError as e:
-                            traceback.print_exc()
-                            print(f"Connection dropped: {e}")
-                            sys.stdout.flush()
-                            sys.stderr.flush()
-                            self.setup_connection()
-                        time.sleep(0.1)
-                except pika.exceptions.AMQPError:
-                    traceback.print_exc()
-                    sys.stdout.flush()
-                    sys.stderr.flush()
-                    time.sleep(5)
-                    self.setup_connection()
-
-        except (KeyboardInterrupt, SystemExit):
-            print("Exiting...")
-            return
+        asyncio.run(self.serve(options))
 
-    def callback(self, channel, method, properties, body):
-        t = threading.Thread(target=self._callback, args=(channel, method, properties, body))
-        t.setDaemon(True)
-        t.start()
+    async def serve(self, options):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
 
-    def nack(self, channel, tag):
-        self.connection.add_callback_threadsafe(
-            functools.partial(channel.basic_nack, delivery_tag=tag)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=options['workers'], thread_name_prefix="rpc"
         )
+        connection = await aio_pika.connect_robust(settings.RABBITMQ_RPC_URL)
+        self.channel = await connection.channel()
+        await self.channel.set_qos(prefetch_count=options['prefetch'], global_=True)
+        queue = await self.channel.declare_queue('billing_rpc', durable=True)
+        consumer_tag = await queue.consume(self.on_message)
+        stats = loop.create_task(self.print_stats(options['stats_interval']))
 
-    def ack(self, channel, tag):
-        self.connection.add_callback_threadsafe(
-            functools.partial(channel.basic_ack, delivery_tag=tag)
-        )
+        print("RPC handler now running", flush=True)
+        await stop.wait()
+
+        print("Exiting...", flush=True)
+        stats.cancel()
+        await queue.cancel(consumer_tag)
+        if self.in_flight:
+            print(f"Waiting for {len(self.in_flight)} in-flight requests", flush=True)
+            _, pending = await asyncio.wait(self.in_flight, timeout=options['shutdown_timeout'])
+            if pending:
+                # Requests that haven't started yet are handed back to rabbitmq. Ones already running can't be
+                # interrupted safely, so they're allowed to finish and acknowledge before we disconnect.
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                print(f"Still waiting for {len(pending)} requests after {options['shutdown_timeout']}s", flush=True)
+                await asyncio.wait(pending)
+        self.executor.shutdown(wait=True)
+        await connection.close()
+        self.report_stats()
+
+    async def print_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.report_stats()
+
+    def report_stats(self):
+        for msg_type, histogram in sorted(self.latency.items()):
+            print(f"{msg_type}: {histogram.summary()}", flush=True)
+
+    async def on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        # Hand off to a task of our own so deliveries are processed concurrently, up to the prefetch limit
+        task = asyncio.get_running_loop().create_task(self.process(message))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    def run_command(self, msg_type, msg):
+        db.close_old_connections()
+        try:
+            return self.commands[msg_type](msg)
+        finally:
+            db.close_old_connections()
 
     @staticmethod
-    def resp(channel, resp, properties, delivery_tag):
-        channel.basic_publish(
-            exchange='',
-            routing_key=properties.reply_to,
-            properties=pika.BasicProperties(correlation_id=properties.correlation_id),
-            body=resp.SerializeToString()
-        )
-        channel.basic_ack(delivery_tag=delivery_tag)
+    async def settle(message: aio_pika.abc.AbstractIncomingMessage, ack: bool):
+        try:
+            if ack:
+                await message.ack()
+            else:
+                await message.nack()
+        except aio_pika.exceptions.AMQPException:
+            traceback.print_exc()
 
-    def _callback(self, channel, method, properties, body):
+    async def process(self, message: aio_pika.abc.AbstractIncomingMessage):
         msg = billing.proto.billing_pb2.BillingRequest()
-        msg.ParseFromString(body)
+        msg.ParseFromString(message.body)
 
         msg_type = msg.WhichOneof("message")
-        if msg_type and msg_type in self.commands:
-            print(f"{properties.correlation_id} - Received {msg_type} request\n{getattr(msg, str(msg_type))}", flush=True)
-            try:
-                resp = self.commands[msg_type](getattr(msg, str(msg_type)))
-            except:
-                traceback.print_exc()
-                sys.stdout.flush()
-                sys.stderr.flush()
-                self.nack(channel, method.delivery_tag)
-                return
-        else:
-            print(f"{properties.correlation_id} - Received unknown request\n{msg}", flush=True)
-            self.ack(channel, method.delivery_tag)
+        if not msg_type or msg_type not in self.commands:
+            print(f"{message.correlation_id} - Received unknown request\n{msg}", flush=True)
+            await self.settle(message, True)
+            return
+
+        print(f"{message.correlation_id} - Received {msg_type} request\n{getattr(msg, msg_type)}", flush=True)
+        start = time.monotonic()
+        try:
+            resp = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.run_command, msg_type, getattr(msg, msg_type)
+            )
+        except asyncio.CancelledError:
+            print(f"{message.correlation_id} - Returning unstarted request", flush=True)
+            await self.settle(message, False)
             return
+        except Exception:
+            traceback.print_exc()
+            self.latency[msg_type].observe(time.monotonic() - start, failed=True)
+            await self.settle(message, False)
+            return
+        self.latency[msg_type].observe(time.monotonic() - start)
 
-        print(f"{properties.correlation_id} - Sending response\n{resp}", flush=True)
+        print(f"{message.correlation_id} - Sending response\n{resp}", flush=True)
 
-        self.connection.add_callback_threadsafe(functools.partial(
-            self.resp, channel=channel, properties=properties, delivery_tag=method.delivery_tag, resp=resp
-        ))
+        try:
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(body=resp.SerializeToString(), correlation_id=message.correlation_id),
+                routing_key=message.reply_to
+            )
+        except aio_pika.exceptions.AMQPException:
+            traceback.print_exc()
+            await self.settle(message, False)
+            return
+        await self.settle(message, True)
 
     @staticmethod
     def convert_currency(msg: billing.proto.billing_pb2.ConvertCurrencyRequest) \
@@ -219,6 +294,62 @@ class Command(BaseCommand):
                 state=tasks.charge_state_to_proto_enum(charge_state.ledger_item.state)
             )
 
+    @staticmethod
+    def charge_users(msg: billing.proto.billing_pb2.ChargeUsersRequest) \
+            -> billing.proto.billing_pb2.ChargeUsersResponse:
+        if len(msg.charges) > tasks.MAX_CHARGE_BATCH:
+            return billing.proto.billing_pb2.ChargeUsersResponse(results=[
+                billing.proto.billing_pb2.ChargeUserResponse(
+                    result=billing.proto.billing_pb2.ChargeUserResponse.FAIL,
+                    message="Batch too large"
+                ) for _ in msg.charges
+            ])
+
+        accounts = {
+            a.user.username: a for a in models.Account.objects.filter(
+                user__username__in=[c.user_id for c in msg.charges]
+            ).select_related('user', 'billing_address')
+        }
+
+        charges = []
+        for c in msg.charges:
+            notif_queue = c.notif_queue.value if c.HasField("notif_queue") else None
+            charges.append(tasks.ChargeRequest(
+                account=accounts.get(c.user_id),
+                amount=decimal.Decimal(c.amount) / decimal.Decimal(100),
+                descriptor=c.descriptor,
+                type_id=c.id,
+                can_reject=c.can_reject,
+                off_session=c.off_session,
+                return_uri=c.return_uri.value if c.HasField("return_uri") else None,
+                notif_queue=notif_queue,
+                supports_delayed=notif_queue is not None,
+            ))
+
+        results = []
+        for result in tasks.charge_accounts(charges):
+            charge_state_id = str(result.charge_state.id) if result.charge_state else ""
+            if result.redirect_uri:
+                results.append(billing.proto.billing_pb2.ChargeUserResponse(
+                    charge_state_id=charge_state_id,
+                    result=billing.proto.billing_pb2.ChargeUserResponse.REDIRECT,
+                    redirect_uri=result.redirect_uri
+                ))
+            elif result.error:
+                results.append(billing.proto.billing_pb2.ChargeUserResponse(
+                    charge_state_id=charge_state_id,
+                    result=billing.proto.billing_pb2.ChargeUserResponse.FAIL,
+                    message=result.error
+                ))
+            else:
+                results.append(billing.proto.billing_pb2.ChargeUserResponse(
+                    charge_state_id=charge_state_id,
+                    result=billing.proto.billing_pb2.ChargeUserResponse.SUCCESS,
+                    state=tasks.charge_state_to_proto_enum(result.charge_state.ledger_item.state)
+                ))
+
+        return billing.proto.billing_pb2.ChargeUsersResponse(results=results)
+
     @staticmethod
     def cloudflare_account(msg: billing.proto.billing_pb2.CloudflareAccountRequest) \
             -> billing.proto.billing_pb2.CloudflareAccountResponse:
@@ -269,4 +400,40 @@ class Command(BaseCommand):
         return billing.proto.billing_pb2.NetboxAccountResponse(
             result=billing.proto.billing_pb2.NetboxAccountResponse.SUCCESS,
             account_id=res,
-        )
\ No newline at end of file
+        )
+
+    @staticmethod
+    def log_usage(msg: billing.proto.billing_pb2.LogUsageRequest) \
+            -> billing.proto.billing_pb2.LogUsageResponse:
+        records = []
+        errors = {}
+        if len(msg.records) > tasks.MAX_USAGE_BATCH:
+            errors = {i: "Batch too large" for i in range(len(msg.records))}
+        else:
+            for i, record in enumerate(msg.records):
+                try:
+                    records.append((i, tasks.parse_usage_record(
+                        record.subscription_id, record.usage,
+                        record.timestamp.value if record.HasField("timestamp") else None
+                    )))
+                except ValueError as e:
+                    errors[i] = str(e)
+
+        result = tasks.log_usage_batch(
+            records,
+            can_reject=msg.can_reject.value if msg.HasField("can_reject") else True,
+            off_session=msg.off_session.value if msg.HasField("off_session") else True,
+            return_uri=msg.return_uri.value if msg.HasField("return_uri") else None
+        )
+        errors.update(result.errors)
+
+        return billing.proto.billing_pb2.LogUsageResponse(
+            accepted=result.accepted,
+            errors=[
+                billing.proto.billing_pb2.UsageRecordError(index=i, message=m) for i, m in sorted(errors.items())
+            ],
+            redirects=[
+                billing.proto.billing_pb2.UsageRedirect(subscription_id=s, redirect_uri=u)
+                for s, u in result.redirect_uris.items()
+            ],
+        )
@@ -0,0 +1,82 @@
+import concurrent.futures
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from billing import models
+from billing.views import webhooks
+
+
+class Command(BaseCommand):
+    help = 'Processes queued webhook events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Number of objects to process concurrently")
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of events to claim per batch")
+        parser.add_argument('--once', action='store_true', help="Process one batch and exit")
+
+    def handle(self, *args, **options):
+        print("Webhook processor now running", flush=True)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            try:
+                while True:
+                    processed = self.run_batch(executor, options['batch_size'])
+                    if options['once']:
+                        break
+                    if not processed:
+                        time.sleep(1)
+            except (KeyboardInterrupt, SystemExit):
+                print("Exiting...")
+
+    def run_batch(self, executor, batch_size):
+        now = timezone.now()
+        # Events for the same object are processed in order on a single worker. An event that is still
+        # backing off holds back everything received after it for that object.
+        backing_off = models.WebhookEvent.objects.filter(
+            state=models.WebhookEvent.STATE_PENDING,
+            provider=OuterRef('provider'),
+            ordering_key=OuterRef('ordering_key'),
+            received_at__lt=OuterRef('received_at'),
+            next_attempt_at__gt=now,
+        )
+        events = models.WebhookEvent.objects.filter(
+            state=models.WebhookEvent.STATE_PENDING,
+            next_attempt_at__lte=now,
+        ).filter(~Exists(backing_off)) \
+            .order_by('received_at') \
+            .values_list('id', 'provider', 'ordering_key')[:batch_size]
+
+        chains = {}
+        for event_id, provider, ordering_key in events:
+            chains.setdefault((provider, ordering_key), []).append(event_id)
+
+        futures = [
+            executor.submit(self.process_chain, provider, event_ids)
+            for (provider, _), event_ids in chains.items()
+        ]
+        processed = 0
+        for future in concurrent.futures.as_completed(futures):
+            processed += future.result()
+        return processed
+
+    @staticmethod
+    def process_chain(provider, event_ids):
+        processed = 0
+        try:
+            # Events for one resource are collapsed and applied together in a single transaction
+            if provider in webhooks.WEBHOOK_BATCH_PROCESSORS:
+                if not webhooks.process_webhook_batch(provider, event_ids):
+                    print(f"Webhook events {', '.join(str(i) for i in event_ids)} failed, will retry", flush=True)
+                    return processed
+                return len(event_ids)
+
+            for event_id in event_ids:
+                if not webhooks.process_webhook_event(event_id):
+                    print(f"Webhook event {event_id} failed, will retry", flush=True)
+                    break
+                processed += 1
+        finally:
+            connections.close_all()
+        return processed
@@ -45,3 +45,9 @@ class Command(BaseCommand):
                 "timestamp": timestamp,
                 "rate": value
             })
+
+            models.ExchangeRateHistory.objects.update_or_create(
+                currency=currency, date=timestamp.date(), defaults={"rate": value}
+            )
+
+        models.ExchangeRate.bump_version()
@@ -1,36 +1,223 @@
+import collections
+import concurrent.futures
+import datetime
+import os
+import threading
+import time
+import traceback
 from django.core.management.base import BaseCommand
-from django.db.models import Q
+from django.db import connections
 import stripe
 from billing import models, tasks
 
+STRIPE_OBJECTS = {
+    models.LedgerItem.TYPE_CARD: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_SEPA: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_SOFORT: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_GIROPAY: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_BANCONTACT: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_EPS: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_IDEAL: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_STRIPE_BACS: (stripe.PaymentIntent, tasks.update_from_payment_intent),
+    models.LedgerItem.TYPE_SOURCES: (stripe.Source, tasks.update_from_source),
+    models.LedgerItem.TYPE_CHARGES: (stripe.Charge, tasks.update_from_charge),
+    models.LedgerItem.TYPE_CHECKOUT: (stripe.checkout.Session, tasks.update_from_checkout_session),
+    models.LedgerItem.TYPE_STRIPE_REFUND: (stripe.Refund, tasks.update_from_stripe_refund),
+}
+STRIPE_LISTABLE = (stripe.PaymentIntent, stripe.Charge, stripe.checkout.Session, stripe.Refund)
+GC_UPDATERS = {
+    models.LedgerItem.TYPE_GOCARDLESS: tasks.update_from_gc_payment,
+    models.LedgerItem.TYPE_GOCARDLESS_PR: tasks.update_from_gc_billing_request,
+}
+
+# Items created within this long of each other are fetched with one list call when there are enough of them
+LIST_CLUSTER_GAP = datetime.timedelta(hours=6)
+LIST_CLUSTER_MIN = 5
+# A list call pages through everything created in its window, so keep the window short even when items keep coming
+LIST_CLUSTER_MAX_SPAN = datetime.timedelta(days=1)
+LIST_SLACK = datetime.timedelta(hours=1)
+LIST_PAGE_SIZE = 100
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(line.strip() for line in f if line.strip())
+
+    def mark(self, ledger_item_id):
+        if not self.path:
+            return
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(f"{ledger_item_id}\n")
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
 
 class Command(BaseCommand):
     help = 'Updates all ledger items in non complete states'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--stripe-workers', type=int, default=8, help="Concurrent requests to Stripe")
+        parser.add_argument('--stripe-rate', type=float, default=20, help="Maximum Stripe requests per second")
+        parser.add_argument('--gocardless-workers', type=int, default=4, help="Concurrent requests to GoCardless")
+        parser.add_argument('--gocardless-rate', type=float, default=8,
+                            help="Maximum GoCardless requests per second")
+        parser.add_argument('--checkpoint', type=str, help="File to record progress in, so an interrupted run resumes")
+
     def handle(self, *args, **options):
+        self.checkpoint = Checkpoint(options['checkpoint'])
+        self.stats = collections.Counter()
+        self.stats_lock = threading.Lock()
+        self.stripe_bucket = TokenBucket(options['stripe_rate'])
+        self.gc_bucket = TokenBucket(options['gocardless_rate'])
+        start = time.monotonic()
+
+        stripe_items = collections.defaultdict(list)
+        gc_items = []
         for ledger_item in models.LedgerItem.objects.filter(
-                Q(state=models.LedgerItem.STATE_PENDING) | Q(state=models.LedgerItem.STATE_PROCESSING)
-        ):
-            if ledger_item.type in (
-                    models.LedgerItem.TYPE_CARD, models.LedgerItem.TYPE_SEPA, models.LedgerItem.TYPE_SOFORT,
-                    models.LedgerItem.TYPE_GIROPAY, models.LedgerItem.TYPE_BANCONTACT, models.LedgerItem.TYPE_EPS,
-                    models.LedgerItem.TYPE_IDEAL, models.LedgerItem.TYPE_STRIPE_BACS,
+                state__in=(models.LedgerItem.STATE_PENDING, models.LedgerItem.STATE_PROCESSING),
+                type__in=list(STRIPE_OBJECTS.keys()) + list(GC_UPDATERS.keys()),
+        ).order_by('timestamp'):
+            if str(ledger_item.id) in self.checkpoint.done:
+                self.count("resumed")
+                continue
+            if ledger_item.type in STRIPE_OBJECTS:
+                stripe_items[STRIPE_OBJECTS[ledger_item.type][0]].append(ledger_item)
+            else:
+                gc_items.append(ledger_item)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options['stripe_workers']) as stripe_pool, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=options['gocardless_workers']) as gc_pool:
+            futures = []
+            for resource, items in stripe_items.items():
+                for cluster in self.clusters(items) if resource in STRIPE_LISTABLE else [[i] for i in items]:
+                    if len(cluster) >= LIST_CLUSTER_MIN:
+                        futures.append(stripe_pool.submit(self.list_stripe, resource, cluster, stripe_pool))
+                    else:
+                        futures.extend(stripe_pool.submit(self.retrieve_stripe, i) for i in cluster)
+            futures.extend(gc_pool.submit(self.update_gc, i) for i in gc_items)
+
+            # List jobs queue retrieves for anything they didn't find, so keep waiting until no new work appears
+            while futures:
+                pending, futures = futures, []
+                for future in concurrent.futures.as_completed(pending):
+                    futures.extend(future.result() or [])
+
+        elapsed = time.monotonic() - start
+        print(
+            f"Updated {self.stats['updated']} ledger items, {self.stats['failed']} failed, "
+            f"{self.stats['resumed']} already done; {self.stats['stripe_requests']} Stripe and "
+            f"{self.stats['gocardless_requests']} GoCardless requests in {elapsed:.1f}s",
+            flush=True
+        )
+        if not self.stats['failed']:
+            self.checkpoint.clear()
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    @staticmethod
+    def clusters(items):
+        cluster = []
+        for item in items:
+            if cluster and (
+                    item.timestamp - cluster[-1].timestamp > LIST_CLUSTER_GAP or
+                    item.timestamp - cluster[0].timestamp > LIST_CLUSTER_MAX_SPAN
             ):
-                payment_intent = stripe.PaymentIntent.retrieve(ledger_item.type_id)
-                tasks.update_from_payment_intent(payment_intent, ledger_item)
-            elif ledger_item.type == models.LedgerItem.TYPE_SOURCES:
-                source = stripe.Source.retrieve(ledger_item.type_id)
-                tasks.update_from_source(source, ledger_item)
-            elif ledger_item.type == models.LedgerItem.TYPE_CHARGES:
-                charge = stripe.Charge.retrieve(ledger_item.type_id)
-                tasks.update_from_charge(charge, ledger_item)
-            elif ledger_item.type == models.LedgerItem.TYPE_CHECKOUT:
-                session = stripe.checkout.Session.retrieve(ledger_item.type_id)
-                tasks.update_from_checkout_session(session, ledger_item)
-            elif ledger_item.type == models.LedgerItem.TYPE_STRIPE_REFUND:
-                refund = stripe.Refund.retrieve(ledger_item.type_id)
-                tasks.update_from_stripe_refund(refund, ledger_item)
-            elif ledger_item.type == models.LedgerItem.TYPE_GOCARDLESS:
-                tasks.update_from_gc_payment(ledger_item.type_id, ledger_item)
-            elif ledger_item.type == models.LedgerItem.TYPE_GOCARDLESS_PR:
-                tasks.update_from_gc_billing_request(ledger_item.type_id, ledger_item)
+                yield cluster
+                cluster = []
+            cluster.append(item)
+        if cluster:
+            yield cluster
+
+    def apply(self, ledger_item, update, *args):
+        try:
+            update(*args, ledger_item)
+        except Exception:
+            traceback.print_exc()
+            self.count("failed")
+        else:
+            self.checkpoint.mark(ledger_item.id)
+            self.count("updated")
+
+    def list_stripe(self, resource, items, stripe_pool):
+        wanted = {i.type_id: i for i in items}
+        update = STRIPE_OBJECTS[items[0].type][1]
+        created = {
+            "gte": int((items[0].timestamp - LIST_SLACK).timestamp()),
+            "lte": int((items[-1].timestamp + LIST_SLACK).timestamp()),
+        }
+
+        try:
+            starting_after = None
+            while wanted:
+                self.stripe_bucket.take()
+                self.count("stripe_requests")
+                params = {"created": created, "limit": LIST_PAGE_SIZE}
+                if starting_after:
+                    params["starting_after"] = starting_after
+                page = resource.list(**params)
+                for obj in page.data:
+                    if obj["id"] in wanted:
+                        self.apply(wanted.pop(obj["id"]), update, obj)
+                if not page.has_more or not page.data:
+                    break
+                starting_after = page.data[-1]["id"]
+        except stripe.error.StripeError:
+            traceback.print_exc()
+        finally:
+            connections.close_all()
+
+        return [stripe_pool.submit(self.retrieve_stripe, i) for i in wanted.values()]
+
+    def retrieve_stripe(self, ledger_item):
+        resource, update = STRIPE_OBJECTS[ledger_item.type]
+        try:
+            self.stripe_bucket.take()
+            self.count("stripe_requests")
+            try:
+                obj = resource.retrieve(ledger_item.type_id)
+            except stripe.error.StripeError:
+                traceback.print_exc()
+                self.count("failed")
+                return
+            self.apply(ledger_item, update, obj)
+        finally:
+            connections.close_all()
+
+    def update_gc(self, ledger_item):
+        try:
+            self.gc_bucket.take()
+            self.count("gocardless_requests")
+            self.apply(ledger_item, lambda item: GC_UPDATERS[item.type](item.type_id, item))
+        finally:
+            connections.close_all()
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_balances(apps, schema_editor):
+    LedgerItem = apps.get_model("billing", "LedgerItem")
+    AccountBalance = apps.get_model("billing", "AccountBalance")
+
+    ledger_items = LedgerItem.objects.filter(account__isnull=False).order_by()
+    balances = []
+    for row in ledger_items.values("account_id", "state").annotate(total=models.Sum("amount")):
+        balances.append(AccountBalance(account_id=row["account_id"], bucket=row["state"], amount=row["total"]))
+    for row in ledger_items.filter(is_reversal=True).values("account_id").annotate(total=models.Sum("amount")):
+        balances.append(AccountBalance(account_id=row["account_id"], bucket="R", amount=row["total"]))
+
+    AccountBalance.objects.bulk_create(balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0052_account_netbox_account_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AccountBalance",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("bucket", models.CharField(choices=[
+                    ("P", "Pending"), ("A", "Processing (cancellable)"), ("S", "Processing"), ("F", "Failed"),
+                    ("C", "Completed"), ("R", "Reversals")
+                ], max_length=1)),
+                ("amount", models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ("account", models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, to="billing.account"
+                )),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="accountbalance",
+            constraint=models.UniqueConstraint(fields=("account", "bucket"), name="unique_account_balance_bucket"),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
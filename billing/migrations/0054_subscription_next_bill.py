@@ -0,0 +1,37 @@
+from django.db import migrations, models
+from dateutil import relativedelta
+import datetime
+
+
+def populate_next_bill(apps, schema_editor):
+    Subscription = apps.get_model("billing", "Subscription")
+
+    for subscription in Subscription.objects.select_related("plan").iterator():
+        plan = subscription.plan
+        if plan.billing_interval_unit == "D":
+            billing_interval = datetime.timedelta(days=plan.billing_interval_value)
+        elif plan.billing_interval_unit == "W":
+            billing_interval = datetime.timedelta(weeks=plan.billing_interval_value)
+        else:
+            billing_interval = relativedelta.relativedelta(months=plan.billing_interval_value)
+        Subscription.objects.filter(id=subscription.id).update(next_bill=subscription.last_billed + billing_interval)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0053_accountbalance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscription",
+            name="next_bill",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_next_bill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(fields=["state", "next_bill"], name="billing_subscription_due_idx"),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0054_subscription_next_bill"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="billingconfig",
+            name="exchange_rate_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def populate_history(apps, schema_editor):
+    ExchangeRate = apps.get_model("billing", "ExchangeRate")
+    ExchangeRateHistory = apps.get_model("billing", "ExchangeRateHistory")
+
+    ExchangeRateHistory.objects.bulk_create([
+        ExchangeRateHistory(date=r.timestamp.date(), currency=r.currency, rate=r.rate)
+        for r in ExchangeRate.objects.all()
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0055_billingconfig_exchange_rate_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExchangeRateHistory",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField()),
+                ("currency", models.CharField(max_length=3)),
+                ("rate", models.DecimalField(decimal_places=7, max_digits=20)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="exchangeratehistory",
+            constraint=models.UniqueConstraint(fields=("currency", "date"), name="unique_exchange_rate_history_day"),
+        ),
+        migrations.RunPython(populate_history, migrations.RunPython.noop),
+    ]
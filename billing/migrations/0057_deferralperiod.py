@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0056_exchangeratehistory"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeferralPeriod",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("month", models.DateField(unique=True)),
+                ("sales", models.DecimalField(decimal_places=2, max_digits=15)),
+                ("prepayments", models.DecimalField(decimal_places=2, max_digits=15)),
+            ],
+            options={
+                "ordering": ["-month"],
+            },
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0057_deferralperiod"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(fields=["type", "state", "type_id"], name="billing_ledger_type_ref_idx"),
+        ),
+    ]
@@ -0,0 +1,46 @@
+import as207960_utils.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0058_ledgeritem_type_ref_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookEvent",
+            fields=[
+                ("id", as207960_utils.models.TypedUUIDField(
+                    data_type="billing_webhookevent", primary_key=True, serialize=False
+                )),
+                ("provider", models.CharField(choices=[
+                    ("S", "Stripe"), ("G", "GoCardless"), ("W", "Wise"), ("M", "Monzo"), ("C", "Coinbase")
+                ], max_length=1)),
+                ("event_id", models.CharField(max_length=255)),
+                ("ordering_key", models.CharField(max_length=255)),
+                ("payload", models.JSONField()),
+                ("received_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("state", models.CharField(choices=[
+                    ("P", "Pending"), ("D", "Processed"), ("F", "Failed")
+                ], default="P", max_length=1)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("next_attempt_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["received_at"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="webhookevent",
+            constraint=models.UniqueConstraint(fields=("provider", "event_id"), name="unique_webhook_event"),
+        ),
+        migrations.AddIndex(
+            model_name="webhookevent",
+            index=models.Index(fields=["state", "received_at"], name="billing_webhook_pending_idx"),
+        ),
+    ]
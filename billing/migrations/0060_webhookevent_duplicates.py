@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0059_webhookevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookevent",
+            name="duplicates",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="billingconfig",
+            name="compacted_webhook_duplicates",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0060_webhookevent_duplicates"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(
+                fields=["type", "state", "last_state_change_timestamp"], name="billing_ledger_stale_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0061_ledgeritem_stale_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(fields=["account", "state"], name="billing_ledger_acct_state_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(fields=["account", "-timestamp"], name="billing_ledger_acct_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(fields=["type", "type_id"], name="billing_ledger_type_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(
+                fields=["state", "type", "country_code", "timestamp"], name="billing_ledger_vat_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ledgeritem",
+            index=models.Index(
+                condition=models.Q(("state__in", ("P", "A", "S"))),
+                fields=["type", "timestamp"],
+                name="billing_ledger_open_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscriptionusage",
+            index=models.Index(fields=["subscription", "-timestamp"], name="billing_usage_sub_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="subscriptioncharge",
+            index=models.Index(fields=["subscription", "-timestamp"], name="billing_charge_sub_time_idx"),
+        ),
+    ]
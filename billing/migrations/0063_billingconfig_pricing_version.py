@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0062_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="billingconfig",
+            name="pricing_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
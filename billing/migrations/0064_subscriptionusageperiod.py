@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0063_billingconfig_pricing_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SubscriptionUsagePeriod",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("period_start", models.DateTimeField()),
+                ("usage_sum", models.PositiveBigIntegerField(default=0)),
+                ("usage_max", models.PositiveIntegerField(blank=True, null=True)),
+                ("usage_count", models.PositiveIntegerField(default=0)),
+                ("last_usage", models.PositiveIntegerField(blank=True, null=True)),
+                ("last_usage_timestamp", models.DateTimeField(blank=True, null=True)),
+                ("subscription", models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, to="billing.subscription"
+                )),
+            ],
+            options={
+                "ordering": ["-period_start"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="subscriptionusageperiod",
+            constraint=models.UniqueConstraint(
+                fields=("subscription", "period_start"), name="unique_subscription_usage_period"
+            ),
+        ),
+    ]
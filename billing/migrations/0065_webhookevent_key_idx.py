@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0064_subscriptionusageperiod"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="webhookevent",
+            index=models.Index(fields=["provider", "ordering_key", "state"], name="billing_webhook_key_idx"),
+        ),
+    ]
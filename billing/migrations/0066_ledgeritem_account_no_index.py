@@ -0,0 +1,19 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0065_webhookevent_key_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ledgeritem",
+            name="account",
+            field=models.ForeignKey(
+                db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to="billing.account"
+            ),
+        ),
+    ]
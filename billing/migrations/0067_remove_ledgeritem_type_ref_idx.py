@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("billing", "0066_ledgeritem_account_no_index"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="ledgeritem",
+            name="billing_ledger_type_ref_idx",
+        ),
+    ]
@@ -1,30 +1,36 @@
 import abc
+import bisect
+import collections
 import dataclasses
 import datetime
 import decimal
 import secrets
 import string
+import threading
+import time
 import typing
 import urllib.parse
+import zoneinfo
 import inflect
 import stripe
-import threading
 import requests
 import as207960_utils.models
 import django.core.exceptions
+import django.db
 from dateutil import relativedelta
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.db.models import F, Q
-from django.db.models.signals import post_save
+from django.db.models.functions import Coalesce, ExtractMonth, Greatest, TruncDate, TruncMonth
+from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.shortcuts import reverse
 from django.core import validators
 from django.utils import timezone
 from django_countries.fields import CountryField
 
-from . import utils, vat, apps
+from . import utils, vat, apps, customer_sync
 
 p = inflect.engine()
 
@@ -34,6 +40,9 @@ class BillingConfig(models.Model):
     freeagent_refresh_token = models.TextField(blank=True, null=True)
     freeagent_access_token_expires_at = models.DateTimeField(blank=True, null=True)
     freeagent_refresh_token_expires_at = models.DateTimeField(blank=True, null=True)
+    exchange_rate_version = models.PositiveIntegerField(default=0)
+    compacted_webhook_duplicates = models.PositiveBigIntegerField(default=0)
+    pricing_version = models.PositiveIntegerField(default=0)
 
     def save(self, *args, **kwargs):
         self.__class__.objects.exclude(id=self.id).delete()
@@ -85,6 +94,20 @@ class BillingConfig(models.Model):
         return None
 
 
+class AccountQuerySet(models.QuerySet):
+    def with_balances(self):
+        return self.select_related('user').annotate(
+            annotated_balance=Coalesce(models.Sum(
+                'accountbalance__amount', filter=Q(accountbalance__bucket=LedgerItem.STATE_COMPLETED)
+            ), decimal.Decimal(0), output_field=models.DecimalField(decimal_places=2, max_digits=15)),
+            annotated_pending_balance=Coalesce(models.Sum(
+                'accountbalance__amount', filter=Q(accountbalance__bucket__in=(
+                    LedgerItem.STATE_PENDING, LedgerItem.STATE_PROCESSING_CANCELLABLE, LedgerItem.STATE_PROCESSING
+                ))
+            ), decimal.Decimal(0), output_field=models.DecimalField(decimal_places=2, max_digits=15)),
+        )
+
+
 class Account(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     exclude_from_accounting = models.BooleanField(blank=True, default=False)
@@ -121,54 +144,49 @@ class Account(models.Model):
     next_invoice_id = models.PositiveIntegerField(default=1)
     crypto_allowed = models.BooleanField(blank=True, default=False)
 
+    objects = AccountQuerySet.as_manager()
+
+    CUSTOMER_FIELDS = ('billing_address_id',)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._virtual_uk_bank = None
         self._virtual_us_bank = None
+        self._synced_customer_fields = self._customer_fields()
+        self._original_exclude_from_accounting = self.__dict__.get('exclude_from_accounting')
+
+    def _customer_fields(self):
+        return {f: self.__dict__.get(f) for f in self.CUSTOMER_FIELDS}
 
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name} {self.user.email} ({self.user.username})"
 
-    @property
-    def balance(self):
+    def _bucket_balance(self, *buckets):
         balance = (
-            self.ledgeritem_set
-           .filter(state=LedgerItem.STATE_COMPLETED)
-           .aggregate(balance=models.Sum('amount'))
-           .get('balance') or decimal.Decimal(0)
+            self.accountbalance_set
+            .filter(bucket__in=buckets)
+            .aggregate(balance=models.Sum('amount'))
+            .get('balance') or decimal.Decimal(0)
         ).quantize(decimal.Decimal('1.00'))
         return balance if balance != 0 else decimal.Decimal(0)
 
+    @property
+    def balance(self):
+        return self._bucket_balance(LedgerItem.STATE_COMPLETED)
+
     @property
     def processing_and_completed_balance(self):
-        balance = (
-            self.ledgeritem_set
-            .filter(Q(state=LedgerItem.STATE_COMPLETED) | Q(state=LedgerItem.STATE_PROCESSING))
-            .aggregate(balance=models.Sum('amount'))
-            .get('balance') or decimal.Decimal(0)
-        ).quantize(decimal.Decimal('1.00'))
-        return balance if balance != 0 else decimal.Decimal(0)
+        return self._bucket_balance(LedgerItem.STATE_COMPLETED, LedgerItem.STATE_PROCESSING)
 
     @property
     def pending_balance(self):
-        balance = (
-            self.ledgeritem_set
-            .filter(Q(state=LedgerItem.STATE_PENDING) | Q(state=LedgerItem.STATE_PROCESSING_CANCELLABLE) |
-                    Q(state=LedgerItem.STATE_PROCESSING))
-            .aggregate(balance=models.Sum('amount'))
-            .get('balance') or decimal.Decimal(0)
-        ).quantize(decimal.Decimal('1.00'))
-        return balance if balance != 0 else decimal.Decimal(0)
+        return self._bucket_balance(
+            LedgerItem.STATE_PENDING, LedgerItem.STATE_PROCESSING_CANCELLABLE, LedgerItem.STATE_PROCESSING
+        )
 
     @property
     def reversal_balance(self):
-        balance = (
-            self.ledgeritem_set
-            .filter(is_reversal=True)
-            .aggregate(balance=models.Sum('amount'))
-            .get('balance') or decimal.Decimal(0)
-        ).quantize(decimal.Decimal('1.00'))
-        balance = balance if balance != 0 else decimal.Decimal(0)
+        balance = self._bucket_balance(AccountBalance.BUCKET_REVERSALS)
         return min(self.balance, balance)
 
     def balance_at(self, timestamp, item_id=None):
@@ -254,46 +272,53 @@ class Account(models.Model):
 
             return self.invoice_prefix
 
-    def save(self, *args, **kwargs):
-        if self.stripe_customer_id:
-            t = threading.Thread(target=stripe.Customer.modify, args=(self.stripe_customer_id,), kwargs={
-                "email": self.user.email,
-                "name": f"{self.user.first_name} {self.user.last_name}",
-                "address": {
-                    "line1": self.billing_address.street_1,
-                    "line2": self.billing_address.street_2,
-                    "city": self.billing_address.city,
-                    "state": self.billing_address.province,
-                    "postal_code": self.billing_address.postal_code,
-                    "country": self.billing_address.country_code.code,
-                } if self.billing_address else None,
-            })
-            t.setDaemon(True)
-            t.start()
+    def sync_stripe_customer(self):
+        if not self.stripe_customer_id:
+            return
 
-        if self.gocardless_customer_id:
-            t = threading.Thread(
-                target=apps.gocardless_client.customers.update, args=(self.gocardless_customer_id,), kwargs={
-                    "params": {
-                        "email": self.user.email,
-                        "family_name": self.user.last_name,
-                        "given_name": self.user.first_name,
-                        "company_name": self.billing_address.organisation if self.billing_address else None,
-                        "address_line1": self.billing_address.street_1 if self.billing_address else None,
-                        "address_line2": self.billing_address.street_2 if self.billing_address else None,
-                        "address_line3": self.billing_address.street_3 if self.billing_address else None,
-                        "city": self.billing_address.city if self.billing_address else None,
-                        "region": self.billing_address.province if self.billing_address else None,
-                        "postal_code": self.billing_address.postal_code if self.billing_address else None,
-                        "country_code": self.billing_address.country_code.code if self.billing_address else None
-                    }
-                }
-            )
-            t.setDaemon(True)
-            t.start()
+        stripe.Customer.modify(
+            self.stripe_customer_id,
+            email=self.user.email,
+            name=f"{self.user.first_name} {self.user.last_name}",
+            address={
+                "line1": self.billing_address.street_1,
+                "line2": self.billing_address.street_2,
+                "city": self.billing_address.city,
+                "state": self.billing_address.province,
+                "postal_code": self.billing_address.postal_code,
+                "country": self.billing_address.country_code.code,
+            } if self.billing_address else None,
+        )
+
+    def sync_gocardless_customer(self):
+        if not self.gocardless_customer_id:
+            return
+
+        apps.gocardless_client.customers.update(self.gocardless_customer_id, params={
+            "email": self.user.email,
+            "family_name": self.user.last_name,
+            "given_name": self.user.first_name,
+            "company_name": self.billing_address.organisation if self.billing_address else None,
+            "address_line1": self.billing_address.street_1 if self.billing_address else None,
+            "address_line2": self.billing_address.street_2 if self.billing_address else None,
+            "address_line3": self.billing_address.street_3 if self.billing_address else None,
+            "city": self.billing_address.city if self.billing_address else None,
+            "region": self.billing_address.province if self.billing_address else None,
+            "postal_code": self.billing_address.postal_code if self.billing_address else None,
+            "country_code": self.billing_address.country_code.code if self.billing_address else None
+        })
 
+    def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
 
+        if self.exclude_from_accounting != self._original_exclude_from_accounting:
+            self._original_exclude_from_accounting = self.exclude_from_accounting
+            DeferralPeriod.invalidate_account(self)
+
+        customer_fields = self._customer_fields()
+        if customer_fields != self._synced_customer_fields:
+            self._synced_customer_fields = customer_fields
+            customer_sync.mark_dirty(self.id)
 
     def merge_account(
             self,
@@ -419,11 +444,25 @@ class Account(models.Model):
         return True, None
 
 
+customer_sync.provider("stripe")(Account.sync_stripe_customer)
+customer_sync.provider("gocardless")(Account.sync_gocardless_customer)
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def track_user_customer_fields(instance, **kwargs):
+    fields = ('first_name', 'last_name', 'email')
+    previous = type(instance).objects.filter(pk=instance.pk).values(*fields).first() if instance.pk else None
+    instance._customer_fields_changed = previous is not None and \
+        any(previous[f] != getattr(instance, f) for f in fields)
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_profile(instance, created, **kwargs):
     if created:
         Account.objects.create(user=instance)
     instance.account.save()
+    if getattr(instance, '_customer_fields_changed', False):
+        customer_sync.mark_dirty(instance.account.id)
 
 
 class AccountStripeVirtualUKBank(models.Model):
@@ -497,6 +536,12 @@ class AccountBillingAddress(models.Model):
                 return self.vat_id
 
 
+@receiver(post_save, sender=AccountBillingAddress)
+def sync_billing_address(instance: AccountBillingAddress, **kwargs):
+    if instance.account and instance.account.billing_address_id == instance.id:
+        customer_sync.mark_dirty(instance.account.id)
+
+
 class KnownBankAccount(models.Model):
     account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True)
     country_code = models.CharField(max_length=2, validators=[validators.MinLengthValidator(2)])
@@ -702,6 +747,120 @@ class GCSEPAMandate(GCMandate):
         verbose_name_plural = "GoCardless SEPA Mandates"
 
 
+def normalise_balance(balance):
+    balance = (balance or decimal.Decimal(0)).quantize(decimal.Decimal('1.00'))
+    return balance if balance != 0 else decimal.Decimal(0)
+
+
+class LedgerItemQuerySet(models.QuerySet):
+    def delete(self):
+        # Bulk deletes (e.g. the admin's delete action) skip LedgerItem.delete, so keep the snapshots in step here
+        with transaction.atomic():
+            items = list(self.order_by().select_for_update().values(*AccountBalance.LEDGER_FIELDS, 'timestamp'))
+            res = super().delete()
+            AccountBalance.apply_ledger_changes([(i, None) for i in items])
+
+            for timestamp in {DeferralPeriod.month_of(i['timestamp']): i['timestamp'] for i in items}.values():
+                DeferralPeriod.invalidate(timestamp)
+
+        return res
+
+    def set_state(self, state: str) -> typing.List["LedgerItem"]:
+        now = timezone.now()
+        with transaction.atomic():
+            items = list(self.select_for_update().exclude(state=state))
+            if not items:
+                return items
+
+            fields = {"state": state, "last_state_change_timestamp": now}
+            if state == LedgerItem.STATE_COMPLETED:
+                fields["completed_timestamp"] = Coalesce("completed_timestamp", models.Value(now))
+            LedgerItem.objects.filter(pk__in=[i.pk for i in items]).update(**fields)
+
+            changes = []
+            for item in items:
+                previous = AccountBalance.ledger_values(item)
+                item.state = state
+                item.last_state_change_timestamp = now
+                if state == LedgerItem.STATE_COMPLETED and not item.completed_timestamp:
+                    item.completed_timestamp = now
+                changes.append((previous, AccountBalance.ledger_values(item)))
+            AccountBalance.apply_ledger_changes(changes)
+
+            for timestamp in {DeferralPeriod.month_of(i.timestamp): i.timestamp for i in items}.values():
+                DeferralPeriod.invalidate(timestamp)
+
+        return items
+
+    def with_running_balance(self, opening_balance=decimal.Decimal(0)):
+        return self.annotate(
+            running_completed_balance=models.Window(
+                expression=models.Sum(models.Case(
+                    models.When(state=LedgerItem.STATE_COMPLETED, then=F('amount')),
+                    default=models.Value(decimal.Decimal(0)),
+                    output_field=models.DecimalField(decimal_places=2, max_digits=15),
+                )),
+                partition_by=[F('account_id')],
+                order_by=F('timestamp').asc(),
+            ),
+            opening_balance=models.Value(
+                opening_balance, output_field=models.DecimalField(decimal_places=2, max_digits=15)
+            ),
+        )
+
+    def statement_balances(self, from_timestamp, to_timestamp):
+        balances = self.filter(state=LedgerItem.STATE_COMPLETED).aggregate(
+            opening_balance=models.Sum('amount', filter=Q(timestamp__lt=from_timestamp)),
+            closing_balance=models.Sum('amount', filter=Q(timestamp__lte=to_timestamp)),
+        )
+        return normalise_balance(balances['opening_balance']), normalise_balance(balances['closing_balance'])
+
+    def vat_totals(self, currency=None):
+        decimal_field = models.DecimalField(decimal_places=9, max_digits=40)
+        totals = collections.defaultdict(lambda: {"gbp": decimal.Decimal(0), "converted": decimal.Decimal(0)})
+        latest = {}
+        items = self.order_by().annotate(month=ExtractMonth('timestamp'))
+        group_by = ('country_code', 'month', 'vat_rate')
+
+        def add(row, gbp, converted=decimal.Decimal(0)):
+            key = (row['country_code'], row['month'], row['vat_rate'])
+            totals[key]["gbp"] += gbp
+            totals[key]["converted"] += converted
+            latest[key] = max(latest.get(key, row['latest']), row['latest'])
+
+        def ordered():
+            # Groups come out in the order a newest-first walk of the items would first reach them
+            return {k: totals[k] for k in sorted(totals, key=lambda k: latest[k], reverse=True)}
+
+        if not currency:
+            for row in items.values(*group_by).annotate(
+                    gbp=models.Sum(-F('amount'), output_field=decimal_field),
+                    latest=models.Max('timestamp'),
+            ):
+                add(row, row['gbp'])
+            return ordered()
+
+        rate_field = f"{currency}_exchange_rate"
+        items = items.annotate(exchange_rate=Coalesce(rate_field, f"reversal_for__{rate_field}"))
+        for row in items.filter(exchange_rate__isnull=False).values(*group_by).annotate(
+                gbp=models.Sum(-F('amount'), output_field=decimal_field),
+                converted=models.Sum(-F('amount') * F('exchange_rate'), output_field=decimal_field),
+                latest=models.Max('timestamp'),
+        ):
+            add(row, row['gbp'], row['converted'])
+
+        # Items without a recorded rate are grouped by day and converted at that day's rate, or today's rate for days
+        # before the rate history starts
+        for row in items.filter(exchange_rate__isnull=True).annotate(date=TruncDate('timestamp')) \
+                .values(*group_by, 'date').annotate(
+                    gbp=models.Sum(-F('amount'), output_field=decimal_field),
+                    latest=models.Max('timestamp'),
+                ):
+            add(row, row['gbp'], row['gbp'] * ExchangeRate.get_rate_at("gbp", currency, row['date']))
+
+        return ordered()
+
+
 class LedgerItem(models.Model):
     STATE_PENDING = "P"
     STATE_PROCESSING_CANCELLABLE = "A"
@@ -758,7 +917,8 @@ class LedgerItem(models.Model):
     )
 
     id = as207960_utils.models.TypedUUIDField('billing_ledgeritem', primary_key=True)
-    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True)
+    # Covered by the (account, state) and (account, timestamp) indexes
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, null=True, db_index=False)
     invoice_id = models.PositiveIntegerField(blank=True, null=True)
     descriptor = models.CharField(max_length=255)
     amount = models.DecimalField(decimal_places=2, max_digits=9, default=0)
@@ -797,8 +957,24 @@ class LedgerItem(models.Model):
     payment_charge_state = models.ForeignKey(
         'ChargeState', on_delete=models.SET_NULL, blank=True, null=True, related_name='payment_items')
 
+    objects = LedgerItemQuerySet.as_manager()
+
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['type', 'state', 'last_state_change_timestamp'], name='billing_ledger_stale_idx'),
+            models.Index(fields=['account', 'state'], name='billing_ledger_acct_state_idx'),
+            models.Index(fields=['account', '-timestamp'], name='billing_ledger_acct_time_idx'),
+            models.Index(fields=['type', 'type_id'], name='billing_ledger_type_id_idx'),
+            models.Index(
+                fields=['state', 'type', 'country_code', 'timestamp'], name='billing_ledger_vat_idx'
+            ),
+            # Pending, processing (cancellable) and processing items only
+            models.Index(
+                fields=['type', 'timestamp'], name='billing_ledger_open_idx',
+                condition=Q(state__in=('P', 'A', 'S')),
+            ),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -818,11 +994,29 @@ class LedgerItem(models.Model):
         if self.state != self.original_state:
             self.last_state_change_timestamp = timezone.now()
 
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = self.__class__.objects.select_for_update().filter(pk=self.pk) \
+                    .values(*AccountBalance.LEDGER_FIELDS, 'timestamp').first()
+            super().save(*args, **kwargs)
+            AccountBalance.apply_ledger_change(previous, AccountBalance.ledger_values(self))
+            DeferralPeriod.invalidate(self.timestamp)
+            if previous and previous['timestamp'] != self.timestamp:
+                DeferralPeriod.invalidate(previous['timestamp'])
 
         from . import tasks
         tasks.try_update_charge_state(instance=self, mail=mail, force_mail=force_mail)
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self.__class__.objects.select_for_update().filter(pk=self.pk) \
+                .values(*AccountBalance.LEDGER_FIELDS, 'timestamp').first()
+            res = super().delete(*args, **kwargs)
+            AccountBalance.apply_ledger_change(previous, None)
+            DeferralPeriod.invalidate(previous['timestamp'] if previous else self.timestamp)
+        return res
+
     @property
     def type_name(self):
         if self.type == self.TYPE_STRIPE_REFUND:
@@ -882,7 +1076,14 @@ class LedgerItem(models.Model):
 
     @property
     def balance_at(self):
-        return self.account.balance_at(self.timestamp, self.id)
+        running_balance = getattr(self, 'running_completed_balance', None)
+        if running_balance is None:
+            return self.account.balance_at(self.timestamp, self.id)
+
+        balance = running_balance + (getattr(self, 'opening_balance', None) or decimal.Decimal(0))
+        if self.state != self.STATE_COMPLETED:
+            balance += self.amount
+        return normalise_balance(balance)
 
     def get_invoice_id(self):
         invoice_prefix = self.account.get_invoice_prefix()
@@ -902,6 +1103,159 @@ class LedgerItem(models.Model):
         return f"{self.descriptor} ({self.id})"
 
 
+class AccountBalance(models.Model):
+    BUCKET_REVERSALS = "R"
+    BUCKETS = LedgerItem.STATES + (
+        (BUCKET_REVERSALS, "Reversals"),
+    )
+    LEDGER_FIELDS = ('account_id', 'state', 'amount', 'is_reversal')
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    bucket = models.CharField(max_length=1, choices=BUCKETS)
+    amount = models.DecimalField(decimal_places=2, max_digits=15, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'bucket'], name='unique_account_balance_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} - {self.get_bucket_display()}"
+
+    @classmethod
+    def ledger_values(cls, ledger_item: LedgerItem):
+        return {f: getattr(ledger_item, f) for f in cls.LEDGER_FIELDS}
+
+    @classmethod
+    def ledger_buckets(cls, values):
+        if not values or not values["account_id"]:
+            return []
+
+        amount = decimal.Decimal(values["amount"] or 0).quantize(decimal.Decimal('1.00'))
+        buckets = [((values["account_id"], values["state"]), amount)]
+        if values["is_reversal"]:
+            buckets.append(((values["account_id"], cls.BUCKET_REVERSALS), amount))
+        return buckets
+
+    @classmethod
+    def apply_ledger_change(cls, previous, current):
+        cls.apply_ledger_changes([(previous, current)])
+
+    @classmethod
+    def apply_ledger_changes(cls, changes):
+        deltas = collections.defaultdict(decimal.Decimal)
+        for previous, current in changes:
+            for key, amount in cls.ledger_buckets(previous):
+                deltas[key] -= amount
+            for key, amount in cls.ledger_buckets(current):
+                deltas[key] += amount
+
+        for (account_id, bucket), delta in deltas.items():
+            if delta == 0:
+                continue
+            cls.objects.get_or_create(account_id=account_id, bucket=bucket)
+            cls.objects.filter(account_id=account_id, bucket=bucket).update(amount=F('amount') + delta)
+
+    @classmethod
+    def ledger_totals(cls, ledger_items=None):
+        if ledger_items is None:
+            ledger_items = LedgerItem.objects.all()
+        ledger_items = ledger_items.filter(account__isnull=False).order_by()
+
+        totals = {}
+        for row in ledger_items.values('account_id', 'state').annotate(total=models.Sum('amount')):
+            totals[(row['account_id'], row['state'])] = row['total']
+        for row in ledger_items.filter(is_reversal=True).values('account_id').annotate(total=models.Sum('amount')):
+            totals[(row['account_id'], cls.BUCKET_REVERSALS)] = row['total']
+        return totals
+
+
+class DeferralPeriod(models.Model):
+    REPORTING_TIMEZONE = zoneinfo.ZoneInfo("Europe/London")
+    FIRST_MONTH = datetime.date(2020, 1, 1)
+
+    month = models.DateField(unique=True)
+    sales = models.DecimalField(decimal_places=2, max_digits=15)
+    prepayments = models.DecimalField(decimal_places=2, max_digits=15)
+
+    class Meta:
+        ordering = ['-month']
+
+    def __str__(self):
+        return self.month.strftime("%B %Y")
+
+    @classmethod
+    def month_of(cls, timestamp: datetime.datetime) -> datetime.date:
+        return timestamp.astimezone(cls.REPORTING_TIMEZONE).date().replace(day=1)
+
+    @classmethod
+    def invalidate(cls, timestamp: datetime.datetime):
+        if not timestamp:
+            return
+        month = cls.month_of(timestamp)
+        if month < cls.month_of(timezone.now()):
+            cls.objects.filter(month=month).delete()
+
+    @classmethod
+    def invalidate_account(cls, account):
+        timestamps = account.ledgeritem_set.order_by().aggregate(
+            first=models.Min('timestamp'), last=models.Max('timestamp')
+        )
+        if timestamps['first']:
+            cls.objects.filter(
+                month__gte=cls.month_of(timestamps['first']), month__lte=cls.month_of(timestamps['last'])
+            ).delete()
+
+    @classmethod
+    def report(cls) -> typing.List[dict]:
+        current_month = cls.month_of(timezone.now())
+        delta = relativedelta.relativedelta(months=1)
+
+        months = []
+        month = cls.FIRST_MONTH
+        while month <= current_month:
+            months.append(month)
+            month += delta
+
+        periods = {p.month: p for p in cls.objects.filter(month__lt=current_month)}
+        missing = [m for m in months if m not in periods]
+
+        ledger_items = LedgerItem.objects.filter(
+            state=LedgerItem.STATE_COMPLETED,
+            account__exclude_from_accounting=False,
+            timestamp__gte=datetime.datetime.combine(missing[0], datetime.time(), tzinfo=cls.REPORTING_TIMEZONE),
+        ).exclude(type=LedgerItem.TYPE_MANUAL).order_by()
+        totals = {
+            row['period'].date(): row for row in ledger_items
+            .annotate(period=TruncMonth('timestamp', tzinfo=cls.REPORTING_TIMEZONE))
+            .values('period')
+            .annotate(
+                sales=models.Sum('amount', filter=Q(amount__lt=0)),
+                prepayments=models.Sum('amount', filter=Q(amount__gte=0)),
+            )
+        }
+
+        new_periods = []
+        for month in missing:
+            row = totals.get(month, {})
+            period = cls(
+                month=month,
+                sales=row.get('sales') or decimal.Decimal(0),
+                prepayments=row.get('prepayments') or decimal.Decimal(0),
+            )
+            periods[month] = period
+            if month < current_month:
+                new_periods.append(period)
+        cls.objects.bulk_create(new_periods, ignore_conflicts=True)
+
+        return [{
+            "start_date": month,
+            "end_date": month + delta - datetime.timedelta(days=1),
+            "sales": periods[month].sales,
+            "prepayments": periods[month].prepayments,
+        } for month in reversed(months)]
+
+
 class ChargeState(models.Model):
     id = as207960_utils.models.TypedUUIDField('billing_charge', primary_key=True)
     account = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True)
@@ -956,6 +1310,17 @@ class ExchangeRate(models.Model):
     def __str__(self):
         return self.currency
 
+    @classmethod
+    def bump_version(cls):
+        config = BillingConfig.load()
+        if not config.pk:
+            config.save()
+        BillingConfig.objects.filter(pk=config.pk).update(exchange_rate_version=F('exchange_rate_version') + 1)
+
+    @classmethod
+    def rates(cls):
+        return exchange_rate_cache.rates()
+
     @classmethod
     def get_rate(cls, from_currency, to_currency):
         from_currency = from_currency.upper()
@@ -964,10 +1329,101 @@ class ExchangeRate(models.Model):
         if from_currency == to_currency:
             return 1
 
-        from_obj = cls.objects.get(currency=from_currency)
-        to_obj = cls.objects.get(currency=to_currency)
+        rates = cls.rates()
+        if from_currency not in rates or to_currency not in rates:
+            raise cls.DoesNotExist(f"No exchange rate for {from_currency} to {to_currency}")
+
+        return rates[to_currency] / rates[from_currency]
+
+    @classmethod
+    def get_rate_at(cls, from_currency, to_currency, date: datetime.date):
+        from_currency = from_currency.upper()
+        to_currency = to_currency.upper()
+
+        if from_currency == to_currency:
+            return 1
+
+        if isinstance(date, datetime.datetime):
+            date = date.astimezone(datetime.timezone.utc).date()
+
+        from_rate = exchange_rate_cache.rate_at(from_currency, date)
+        to_rate = exchange_rate_cache.rate_at(to_currency, date)
+        # Dates before the history starts (e.g. before backfill-exchange has been run) use today's rate
+        if from_rate is None or to_rate is None:
+            return cls.get_rate(from_currency, to_currency)
+
+        return to_rate / from_rate
+
+    @classmethod
+    def convert_many(cls, amounts: typing.Iterable[typing.Tuple[decimal.Decimal, str]], to_currency: str) \
+            -> typing.List[decimal.Decimal]:
+        factors = {}
+        converted = []
+        for amount, from_currency in amounts:
+            from_currency = from_currency.upper()
+            if from_currency not in factors:
+                factors[from_currency] = cls.get_rate(from_currency, to_currency)
+            converted.append(amount * factors[from_currency])
+        return converted
+
+
+class ExchangeRateHistory(models.Model):
+    date = models.DateField()
+    currency = models.CharField(max_length=3)
+    rate = models.DecimalField(decimal_places=7, max_digits=20)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_exchange_rate_history_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.date}"
+
+
+class ExchangeRateCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rates = None
+        self._history = {}
+        self._version = None
+        self._checked = 0
+
+    def _refresh(self):
+        if self._rates is not None and time.monotonic() - self._checked < settings.EXCHANGE_RATE_CACHE_TTL:
+            return
+
+        with self._lock:
+            version = BillingConfig.objects.values_list('exchange_rate_version', flat=True).first() or 0
+            if self._rates is None or version != self._version:
+                self._rates = dict(ExchangeRate.objects.values_list('currency', 'rate'))
+                self._history = {}
+                self._version = version
+            self._checked = time.monotonic()
+
+    def rates(self) -> typing.Dict[str, decimal.Decimal]:
+        self._refresh()
+        return self._rates
+
+    def rate_at(self, currency: str, date: datetime.date) -> typing.Optional[decimal.Decimal]:
+        self._refresh()
+        history = self._history.get(currency)
+        if history is None:
+            rows = list(
+                ExchangeRateHistory.objects.filter(currency=currency).order_by('date').values_list('date', 'rate')
+            )
+            history = ([r[0] for r in rows], [r[1] for r in rows])
+            self._history[currency] = history
+
+        dates, rates = history
+        # ECB doesn't publish on weekends and holidays, so use the last published rate on or before the date
+        i = bisect.bisect_right(dates, date)
+        if i == 0:
+            return None
+        return rates[i - 1]
+
 
-        return to_obj.rate / from_obj.rate
+exchange_rate_cache = ExchangeRateCache()
 
 
 class RecurringPlan(models.Model):
@@ -1030,24 +1486,27 @@ class RecurringPlan(models.Model):
         elif self.billing_interval_unit == self.INTERVAL_MONTH:
             return relativedelta.relativedelta(months=self.billing_interval_value)
 
+    def save(self, *args, **kwargs):
+        previous = RecurringPlan.objects.filter(id=self.id) \
+            .values('billing_interval_value', 'billing_interval_unit').first()
+        super().save(*args, **kwargs)
+        PlanPricingCache.bump_version()
+        if previous and (previous['billing_interval_value'], previous['billing_interval_unit']) != \
+                (self.billing_interval_value, self.billing_interval_unit):
+            billing_interval = self.billing_interval
+            for subscription_id, last_billed in self.subscription_set.values_list('id', 'last_billed'):
+                Subscription.objects.filter(id=subscription_id).update(next_bill=last_billed + billing_interval)
+
+    @property
+    def pricing(self) -> "CompiledPricing":
+        return plan_pricing_cache.get(self)
+
     def calculate_charge(self, units: int) -> decimal.Decimal:
-        if self.tiers_type == self.TIERS_VOLUME:
-            tier = self.recurringplantier_set.filter(Q(last_unit__lte=units) | Q(last_unit__isnull=True)) \
-                .order_by(F('last_unit').desc(nulls_last=True)).first()
-            return (tier.price_per_unit * decimal.Decimal(units)) + tier.flat_fee
-        elif self.tiers_type == self.TIERS_GRADUATED:
-            tiers = self.recurringplantier_set.order_by(F('last_unit').asc(nulls_last=True))
-            total = decimal.Decimal(0)
-            for tier in tiers:
-                if tier.last_unit:
-                    nums = min(units, tier.last_unit)
-                else:
-                    nums = units
-                total += (tier.price_per_unit * decimal.Decimal(nums)) + tier.flat_fee
-                units -= nums
-                if units <= 0:
-                    break
-            return total
+        return self.pricing.charge(units)
+
+    def calculate_charges(self, units: typing.Iterable[int]) -> typing.List[decimal.Decimal]:
+        pricing = self.pricing
+        return [pricing.charge(u) for u in units]
 
     def __str__(self):
         return self.name
@@ -1063,6 +1522,107 @@ class RecurringPlanTier(models.Model):
     class Meta:
         ordering = ('last_unit', 'id')
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        PlanPricingCache.bump_version()
+
+    def delete(self, *args, **kwargs):
+        res = super().delete(*args, **kwargs)
+        PlanPricingCache.bump_version()
+        return res
+
+
+class CompiledPricing:
+    def __init__(self, tiers_type: str, tiers: typing.List["RecurringPlanTier"]):
+        self.tiers_type = tiers_type
+        tiers = sorted(tiers, key=lambda t: (t.last_unit is None, t.last_unit or 0, str(t.id)))
+
+        if tiers_type == RecurringPlan.TIERS_VOLUME:
+            bounded = [t for t in tiers if t.last_unit is not None]
+            unbounded = next((t for t in tiers if t.last_unit is None), None)
+            self.bounds = [t.last_unit for t in bounded]
+            self.prices = [t.price_per_unit for t in bounded]
+            self.fees = [t.flat_fee for t in bounded]
+            self.unbounded = (unbounded.price_per_unit, unbounded.flat_fee) if unbounded else None
+        elif tiers_type == RecurringPlan.TIERS_GRADUATED:
+            # Each tier's last_unit is how many units it covers; tiers after the first open-ended one never apply
+            self.prices = []
+            self.fees = []
+            self.bounds = []
+            self.prefix_charges = [decimal.Decimal(0)]
+            for tier in tiers:
+                self.prices.append(tier.price_per_unit)
+                self.fees.append(tier.flat_fee)
+                if not tier.last_unit:
+                    break
+                self.bounds.append((self.bounds[-1] if self.bounds else 0) + tier.last_unit)
+                self.prefix_charges.append(
+                    self.prefix_charges[-1] + ((tier.price_per_unit * decimal.Decimal(tier.last_unit)) + tier.flat_fee)
+                )
+
+    def charge(self, units: int) -> typing.Optional[decimal.Decimal]:
+        if self.tiers_type == RecurringPlan.TIERS_VOLUME:
+            i = bisect.bisect_right(self.bounds, units)
+            if i:
+                price, fee = self.prices[i - 1], self.fees[i - 1]
+            elif self.unbounded:
+                price, fee = self.unbounded
+            else:
+                raise RecurringPlanTier.DoesNotExist()
+            return (price * decimal.Decimal(units)) + fee
+        elif self.tiers_type == RecurringPlan.TIERS_GRADUATED:
+            if not self.prices:
+                return decimal.Decimal(0)
+            i = bisect.bisect_left(self.bounds, units)
+            if i >= len(self.prices):
+                return self.prefix_charges[-1]
+            start = self.bounds[i - 1] if i else 0
+            return self.prefix_charges[i] + ((self.prices[i] * decimal.Decimal(units - start)) + self.fees[i])
+
+
+class PlanPricingCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans = {}
+        self._version = None
+        self._checked = 0
+
+    @staticmethod
+    def bump_version():
+        config = BillingConfig.load()
+        if not config.pk:
+            config.save()
+        BillingConfig.objects.filter(pk=config.pk).update(pricing_version=F('pricing_version') + 1)
+        plan_pricing_cache.clear()
+
+    def clear(self):
+        with self._lock:
+            self._plans = {}
+            self._checked = 0
+
+    def _refresh(self):
+        if self._version is not None and time.monotonic() - self._checked < settings.PLAN_PRICING_CACHE_TTL:
+            return
+
+        with self._lock:
+            version = BillingConfig.objects.values_list('pricing_version', flat=True).first() or 0
+            if version != self._version:
+                self._plans = {}
+                self._version = version
+            self._checked = time.monotonic()
+
+    def get(self, plan: RecurringPlan) -> CompiledPricing:
+        self._refresh()
+        key = (plan.id, plan.tiers_type)
+        pricing = self._plans.get(key)
+        if pricing is None:
+            pricing = CompiledPricing(plan.tiers_type, list(RecurringPlanTier.objects.filter(plan_id=plan.id)))
+            self._plans[key] = pricing
+        return pricing
+
+
+plan_pricing_cache = PlanPricingCache()
+
 
 class Subscription(models.Model):
     STATE_PENDING = "E"
@@ -1080,12 +1640,28 @@ class Subscription(models.Model):
     plan = models.ForeignKey(RecurringPlan, on_delete=models.CASCADE)
     account = models.ForeignKey(Account, on_delete=models.CASCADE, blank=True, null=True)
     last_billed = models.DateTimeField()
+    next_bill = models.DateTimeField(blank=True, null=True)
     state = models.CharField(max_length=1, choices=STATES)
 
-    @property
-    def next_bill(self):
-        billing_interval = self.plan.billing_interval
-        return self.last_billed + billing_interval
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'next_bill'], name='billing_subscription_due_idx'),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._original_last_billed = self.__dict__.get('last_billed')
+
+    def save(self, *args, **kwargs):
+        self.next_bill = self.last_billed + self.plan.billing_interval
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'next_bill'}
+        super().save(*args, **kwargs)
+
+        if self.last_billed != self._original_last_billed:
+            self._original_last_billed = self.last_billed
+            if self.plan.billing_type == RecurringPlan.TYPE_METERED:
+                SubscriptionUsagePeriod.current(self)
 
     @property
     def next_bill_attempt(self):
@@ -1158,21 +1734,11 @@ class Subscription(models.Model):
                 else:
                     return last_usage.usage_units
             elif self.plan.aggregation_type == RecurringPlan.AGGREGATION_LAST_PERIOD:
-                last_usage = self.subscriptionusage_set.filter(timestamp__gt=self.last_billed).first()
-                if not last_usage:
-                    return 0
-                else:
-                    return last_usage.usage_units
+                return SubscriptionUsagePeriod.current(self).last_usage or 0
             elif self.plan.aggregation_type == RecurringPlan.AGGREGATION_SUM:
-                last_usage = self.subscriptionusage_set.filter(timestamp__gt=self.last_billed) \
-                                 .aggregate(usage=models.Sum('usage_units')) \
-                                 .get('usage') or 0
-                return last_usage
+                return SubscriptionUsagePeriod.current(self).usage_sum
             elif self.plan.aggregation_type == RecurringPlan.AGGREGATION_MAX:
-                last_usage = self.subscriptionusage_set.filter(timestamp__gt=self.last_billed) \
-                                 .aggregate(usage=models.Max('usage_units')) \
-                                 .get('usage') or 0
-                return last_usage
+                return SubscriptionUsagePeriod.current(self).usage_max or 0
 
     @property
     def next_charge(self):
@@ -1187,6 +1753,101 @@ class SubscriptionUsage(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['subscription', '-timestamp'], name='billing_usage_sub_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if timezone.is_naive(self.timestamp):
+            self.timestamp = timezone.make_aware(self.timestamp)
+
+        with transaction.atomic():
+            if not self._state.adding:
+                super().save(*args, **kwargs)
+                SubscriptionUsagePeriod.objects.filter(subscription_id=self.subscription_id).delete()
+                return
+
+            # Holding the subscription row stops a billing run rolling the period over underneath us
+            subscription = Subscription.objects.select_for_update().select_related('plan') \
+                .get(id=self.subscription_id)
+            period = None
+            if subscription.plan.billing_type == RecurringPlan.TYPE_METERED and \
+                    self.timestamp > subscription.last_billed:
+                period = SubscriptionUsagePeriod.current(subscription)
+            super().save(*args, **kwargs)
+            if period:
+                period.record([self])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            res = super().delete(*args, **kwargs)
+            SubscriptionUsagePeriod.objects.filter(subscription_id=self.subscription_id).delete()
+        return res
+
+
+class SubscriptionUsagePeriod(models.Model):
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE)
+    period_start = models.DateTimeField()
+    usage_sum = models.PositiveBigIntegerField(default=0)
+    usage_max = models.PositiveIntegerField(blank=True, null=True)
+    usage_count = models.PositiveIntegerField(default=0)
+    last_usage = models.PositiveIntegerField(blank=True, null=True)
+    last_usage_timestamp = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-period_start']
+        constraints = [
+            models.UniqueConstraint(fields=['subscription', 'period_start'], name='unique_subscription_usage_period'),
+        ]
+
+    @classmethod
+    def current(cls, subscription: Subscription) -> "SubscriptionUsagePeriod":
+        period = cls.objects.filter(subscription=subscription, period_start=subscription.last_billed).first()
+        if period:
+            return period
+
+        usage = subscription.subscriptionusage_set.filter(timestamp__gt=subscription.last_billed)
+        totals = usage.aggregate(
+            usage_sum=models.Sum('usage_units'),
+            usage_max=models.Max('usage_units'),
+            usage_count=models.Count('id'),
+        )
+        last_usage = usage.first()
+        period, _ = cls.objects.get_or_create(
+            subscription=subscription, period_start=subscription.last_billed, defaults={
+                "usage_sum": totals["usage_sum"] or 0,
+                "usage_max": totals["usage_max"],
+                "usage_count": totals["usage_count"],
+                "last_usage": last_usage.usage_units if last_usage else None,
+                "last_usage_timestamp": last_usage.timestamp if last_usage else None,
+            }
+        )
+        return period
+
+    def record(self, usages: typing.List[SubscriptionUsage]):
+        if not usages:
+            return
+
+        latest = max(usages, key=lambda u: u.timestamp)
+        is_latest = Q(last_usage_timestamp__isnull=True) | Q(last_usage_timestamp__lte=latest.timestamp)
+        max_units = models.Value(max(u.usage_units for u in usages), output_field=models.PositiveIntegerField())
+        self.__class__.objects.filter(pk=self.pk).update(
+            usage_sum=F('usage_sum') + sum(u.usage_units for u in usages),
+            usage_max=Greatest(
+                Coalesce('usage_max', max_units, output_field=models.PositiveIntegerField()), max_units,
+                output_field=models.PositiveIntegerField()
+            ),
+            usage_count=F('usage_count') + len(usages),
+            last_usage=models.Case(
+                models.When(is_latest, then=models.Value(latest.usage_units)), default=F('last_usage'),
+                output_field=models.PositiveIntegerField()
+            ),
+            last_usage_timestamp=models.Case(
+                models.When(is_latest, then=models.Value(latest.timestamp)), default=F('last_usage_timestamp'),
+                output_field=models.DateTimeField()
+            ),
+        )
+        self.refresh_from_db()
 
 
 class SubscriptionCharge(models.Model):
@@ -1204,6 +1865,9 @@ class SubscriptionCharge(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['subscription', '-timestamp'], name='billing_charge_sub_time_idx'),
+        ]
 
 
 def make_invoice_ref():
@@ -1252,3 +1916,110 @@ class FreeagentInvoice(models.Model):
     temp_account = models.BooleanField(blank=True)
     charge_state = models.OneToOneField(ChargeState, on_delete=models.PROTECT, blank=True, null=True)
     freeagent_id = models.CharField(max_length=255)
+
+
+class WebhookEvent(models.Model):
+    PROVIDER_STRIPE = "S"
+    PROVIDER_GOCARDLESS = "G"
+    PROVIDER_WISE = "W"
+    PROVIDER_MONZO = "M"
+    PROVIDER_COINBASE = "C"
+    PROVIDERS = (
+        (PROVIDER_STRIPE, "Stripe"),
+        (PROVIDER_GOCARDLESS, "GoCardless"),
+        (PROVIDER_WISE, "Wise"),
+        (PROVIDER_MONZO, "Monzo"),
+        (PROVIDER_COINBASE, "Coinbase"),
+    )
+
+    STATE_PENDING = "P"
+    STATE_PROCESSED = "D"
+    STATE_FAILED = "F"
+    STATES = (
+        (STATE_PENDING, "Pending"),
+        (STATE_PROCESSED, "Processed"),
+        (STATE_FAILED, "Failed"),
+    )
+
+    MAX_ATTEMPTS = 8
+    RETRY_BASE = datetime.timedelta(seconds=30)
+    RETRY_MAX = datetime.timedelta(hours=6)
+
+    id = as207960_utils.models.TypedUUIDField('billing_webhookevent', primary_key=True)
+    provider = models.CharField(max_length=1, choices=PROVIDERS)
+    event_id = models.CharField(max_length=255)
+    ordering_key = models.CharField(max_length=255)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(default=timezone.now)
+    state = models.CharField(max_length=1, choices=STATES, default=STATE_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    duplicates = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_webhook_event'),
+        ]
+        indexes = [
+            models.Index(fields=['state', 'received_at'], name='billing_webhook_pending_idx'),
+            models.Index(fields=['provider', 'ordering_key', 'state'], name='billing_webhook_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_provider_display()} {self.event_id}"
+
+    @classmethod
+    def ingest(cls, provider: str, event_id: str, ordering_key: str, payload) -> bool:
+        if cls.objects.filter(provider=provider, event_id=event_id).update(duplicates=F('duplicates') + 1):
+            return False
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(provider=provider, event_id=event_id, ordering_key=ordering_key, payload=payload)
+        except django.db.IntegrityError:
+            cls.objects.filter(provider=provider, event_id=event_id).update(duplicates=F('duplicates') + 1)
+            return False
+        return True
+
+    @classmethod
+    def suppressed_duplicates(cls) -> int:
+        live = cls.objects.aggregate(duplicates=models.Sum('duplicates')).get('duplicates') or 0
+        compacted = BillingConfig.objects.values_list('compacted_webhook_duplicates', flat=True).first() or 0
+        return live + compacted
+
+    @classmethod
+    def compact(cls, before: datetime.datetime, batch_size=1000) -> int:
+        config = BillingConfig.load()
+        if not config.pk:
+            config.save()
+
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                batch = list(cls.objects.filter(state=cls.STATE_PROCESSED, processed_at__lt=before)
+                             .order_by('processed_at').values_list('id', 'duplicates')[:batch_size])
+                if not batch:
+                    return deleted
+                cls.objects.filter(id__in=[b[0] for b in batch]).delete()
+                BillingConfig.objects.filter(pk=config.pk).update(
+                    compacted_webhook_duplicates=F('compacted_webhook_duplicates') + sum(b[1] for b in batch)
+                )
+            deleted += len(batch)
+
+    def mark_processed(self):
+        self.state = self.STATE_PROCESSED
+        self.processed_at = timezone.now()
+        self.last_error = None
+        self.save()
+
+    def mark_failed(self, error: str):
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.state = self.STATE_FAILED
+        else:
+            self.next_attempt_at = timezone.now() + min(self.RETRY_BASE * (2 ** (self.attempts - 1)), self.RETRY_MAX)
+        self.save()
@@ -1,9 +1,9 @@
 import typing
 import requests
 from django.conf import settings
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import pre_delete
 from django.dispatch import receiver
-from . import models, tasks
+from . import models, customer_sync
 
 
 def setup_netbox_account(account: models.Account) -> typing.Optional[int]:
@@ -59,7 +59,7 @@ def delete_netbox_account(account: models.Account):
     account.save()
 
 
-@tasks.as_thread
+@customer_sync.provider("netbox")
 def update_netbox_account_name(account: models.Account):
     if not account.netbox_account_id:
         return
@@ -80,12 +80,3 @@ def update_netbox_account_name(account: models.Account):
 @receiver(pre_delete, sender=models.Account)
 def account_delete_handler(_sender, instance: models.Account, **kwargs):
     delete_netbox_account(instance)
-
-@receiver(post_save, sender=models.Account)
-def send_charge_state_notif_receiver(instance: models.Account, **kwargs):
-    update_netbox_account_name(instance)
-
-@receiver(post_save, sender=models.AccountBillingAddress)
-def send_charge_state_notif_receiver(instance: models.AccountBillingAddress, **kwargs):
-    if instance.account.billing_address == instance:
-        update_netbox_account_name(instance.account)
\ No newline at end of file
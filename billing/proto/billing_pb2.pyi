@@ -4,7 +4,9 @@ isort:skip_file
 """
 
 import builtins
+import collections.abc
 import google.protobuf.descriptor
+import google.protobuf.internal.containers
 import google.protobuf.internal.enum_type_wrapper
 import google.protobuf.message
 import google.protobuf.wrappers_pb2
@@ -68,6 +70,8 @@ class BillingRequest(google.protobuf.message.Message):
     CHARGE_USER_FIELD_NUMBER: builtins.int
     CLOUDFLARE_ACCOUNT_FIELD_NUMBER: builtins.int
     NETBOX_ACCOUNT_FIELD_NUMBER: builtins.int
+    LOG_USAGE_FIELD_NUMBER: builtins.int
+    CHARGE_USERS_FIELD_NUMBER: builtins.int
     @property
     def convert_currency(self) -> global___ConvertCurrencyRequest: ...
     @property
@@ -76,6 +80,10 @@ class BillingRequest(google.protobuf.message.Message):
     def cloudflare_account(self) -> global___CloudflareAccountRequest: ...
     @property
     def netbox_account(self) -> global___NetboxAccountRequest: ...
+    @property
+    def log_usage(self) -> global___LogUsageRequest: ...
+    @property
+    def charge_users(self) -> global___ChargeUsersRequest: ...
     def __init__(
         self,
         *,
@@ -83,10 +91,12 @@ class BillingRequest(google.protobuf.message.Message):
         charge_user: global___ChargeUserRequest | None = ...,
         cloudflare_account: global___CloudflareAccountRequest | None = ...,
         netbox_account: global___NetboxAccountRequest | None = ...,
+        log_usage: global___LogUsageRequest | None = ...,
+        charge_users: global___ChargeUsersRequest | None = ...,
     ) -> None: ...
-    def HasField(self, field_name: typing.Literal["charge_user", b"charge_user", "cloudflare_account", b"cloudflare_account", "convert_currency", b"convert_currency", "message", b"message", "netbox_account", b"netbox_account"]) -> builtins.bool: ...
-    def ClearField(self, field_name: typing.Literal["charge_user", b"charge_user", "cloudflare_account", b"cloudflare_account", "convert_currency", b"convert_currency", "message", b"message", "netbox_account", b"netbox_account"]) -> None: ...
-    def WhichOneof(self, oneof_group: typing.Literal["message", b"message"]) -> typing.Literal["convert_currency", "charge_user", "cloudflare_account", "netbox_account"] | None: ...
+    def HasField(self, field_name: typing.Literal["charge_user", b"charge_user", "charge_users", b"charge_users", "cloudflare_account", b"cloudflare_account", "convert_currency", b"convert_currency", "log_usage", b"log_usage", "message", b"message", "netbox_account", b"netbox_account"]) -> builtins.bool: ...
+    def ClearField(self, field_name: typing.Literal["charge_user", b"charge_user", "charge_users", b"charge_users", "cloudflare_account", b"cloudflare_account", "convert_currency", b"convert_currency", "log_usage", b"log_usage", "message", b"message", "netbox_account", b"netbox_account"]) -> None: ...
+    def WhichOneof(self, oneof_group: typing.Literal["message", b"message"]) -> typing.Literal["convert_currency", "charge_user", "cloudflare_account", "netbox_account", "log_usage", "charge_users"] | None: ...
 
 global___BillingRequest = BillingRequest
 
@@ -234,6 +244,38 @@ class ChargeUserResponse(google.protobuf.message.Message):
 
 global___ChargeUserResponse = ChargeUserResponse
 
+@typing.final
+class ChargeUsersRequest(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    CHARGES_FIELD_NUMBER: builtins.int
+    @property
+    def charges(self) -> google.protobuf.internal.containers.RepeatedCompositeFieldContainer[global___ChargeUserRequest]: ...
+    def __init__(
+        self,
+        *,
+        charges: collections.abc.Iterable[global___ChargeUserRequest] | None = ...,
+    ) -> None: ...
+    def ClearField(self, field_name: typing.Literal["charges", b"charges"]) -> None: ...
+
+global___ChargeUsersRequest = ChargeUsersRequest
+
+@typing.final
+class ChargeUsersResponse(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    RESULTS_FIELD_NUMBER: builtins.int
+    @property
+    def results(self) -> google.protobuf.internal.containers.RepeatedCompositeFieldContainer[global___ChargeUserResponse]: ...
+    def __init__(
+        self,
+        *,
+        results: collections.abc.Iterable[global___ChargeUserResponse] | None = ...,
+    ) -> None: ...
+    def ClearField(self, field_name: typing.Literal["results", b"results"]) -> None: ...
+
+global___ChargeUsersResponse = ChargeUsersResponse
+
 @typing.final
 class ChargeStateNotification(google.protobuf.message.Message):
     DESCRIPTOR: google.protobuf.descriptor.Descriptor
@@ -450,3 +492,114 @@ class NetboxAccountResponse(google.protobuf.message.Message):
     def ClearField(self, field_name: typing.Literal["account_id", b"account_id", "result", b"result"]) -> None: ...
 
 global___NetboxAccountResponse = NetboxAccountResponse
+
+@typing.final
+class UsageRecord(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    SUBSCRIPTION_ID_FIELD_NUMBER: builtins.int
+    USAGE_FIELD_NUMBER: builtins.int
+    TIMESTAMP_FIELD_NUMBER: builtins.int
+    subscription_id: builtins.str
+    usage: builtins.int
+    @property
+    def timestamp(self) -> google.protobuf.wrappers_pb2.Int64Value: ...
+    def __init__(
+        self,
+        *,
+        subscription_id: builtins.str = ...,
+        usage: builtins.int = ...,
+        timestamp: google.protobuf.wrappers_pb2.Int64Value | None = ...,
+    ) -> None: ...
+    def HasField(self, field_name: typing.Literal["timestamp", b"timestamp"]) -> builtins.bool: ...
+    def ClearField(self, field_name: typing.Literal["subscription_id", b"subscription_id", "timestamp", b"timestamp", "usage", b"usage"]) -> None: ...
+
+global___UsageRecord = UsageRecord
+
+@typing.final
+class LogUsageRequest(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    RECORDS_FIELD_NUMBER: builtins.int
+    CAN_REJECT_FIELD_NUMBER: builtins.int
+    OFF_SESSION_FIELD_NUMBER: builtins.int
+    RETURN_URI_FIELD_NUMBER: builtins.int
+    @property
+    def records(self) -> google.protobuf.internal.containers.RepeatedCompositeFieldContainer[global___UsageRecord]: ...
+    @property
+    def can_reject(self) -> google.protobuf.wrappers_pb2.BoolValue: ...
+    @property
+    def off_session(self) -> google.protobuf.wrappers_pb2.BoolValue: ...
+    @property
+    def return_uri(self) -> google.protobuf.wrappers_pb2.StringValue: ...
+    def __init__(
+        self,
+        *,
+        records: collections.abc.Iterable[global___UsageRecord] | None = ...,
+        can_reject: google.protobuf.wrappers_pb2.BoolValue | None = ...,
+        off_session: google.protobuf.wrappers_pb2.BoolValue | None = ...,
+        return_uri: google.protobuf.wrappers_pb2.StringValue | None = ...,
+    ) -> None: ...
+    def HasField(self, field_name: typing.Literal["can_reject", b"can_reject", "off_session", b"off_session", "return_uri", b"return_uri"]) -> builtins.bool: ...
+    def ClearField(self, field_name: typing.Literal["can_reject", b"can_reject", "off_session", b"off_session", "records", b"records", "return_uri", b"return_uri"]) -> None: ...
+
+global___LogUsageRequest = LogUsageRequest
+
+@typing.final
+class UsageRecordError(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    INDEX_FIELD_NUMBER: builtins.int
+    MESSAGE_FIELD_NUMBER: builtins.int
+    index: builtins.int
+    message: builtins.str
+    def __init__(
+        self,
+        *,
+        index: builtins.int = ...,
+        message: builtins.str = ...,
+    ) -> None: ...
+    def ClearField(self, field_name: typing.Literal["index", b"index", "message", b"message"]) -> None: ...
+
+global___UsageRecordError = UsageRecordError
+
+@typing.final
+class UsageRedirect(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    SUBSCRIPTION_ID_FIELD_NUMBER: builtins.int
+    REDIRECT_URI_FIELD_NUMBER: builtins.int
+    subscription_id: builtins.str
+    redirect_uri: builtins.str
+    def __init__(
+        self,
+        *,
+        subscription_id: builtins.str = ...,
+        redirect_uri: builtins.str = ...,
+    ) -> None: ...
+    def ClearField(self, field_name: typing.Literal["redirect_uri", b"redirect_uri", "subscription_id", b"subscription_id"]) -> None: ...
+
+global___UsageRedirect = UsageRedirect
+
+@typing.final
+class LogUsageResponse(google.protobuf.message.Message):
+    DESCRIPTOR: google.protobuf.descriptor.Descriptor
+
+    ACCEPTED_FIELD_NUMBER: builtins.int
+    ERRORS_FIELD_NUMBER: builtins.int
+    REDIRECTS_FIELD_NUMBER: builtins.int
+    accepted: builtins.int
+    @property
+    def errors(self) -> google.protobuf.internal.containers.RepeatedCompositeFieldContainer[global___UsageRecordError]: ...
+    @property
+    def redirects(self) -> google.protobuf.internal.containers.RepeatedCompositeFieldContainer[global___UsageRedirect]: ...
+    def __init__(
+        self,
+        *,
+        accepted: builtins.int = ...,
+        errors: collections.abc.Iterable[global___UsageRecordError] | None = ...,
+        redirects: collections.abc.Iterable[global___UsageRedirect] | None = ...,
+    ) -> None: ...
+    def ClearField(self, field_name: typing.Literal["accepted", b"accepted", "errors", b"errors", "redirects", b"redirects"]) -> None: ...
+
+global___LogUsageResponse = LogUsageResponse
@@ -0,0 +1,78 @@
+import csv
+import decimal
+import typing
+from django.db.models import Q, Sum
+from django.http import StreamingHttpResponse
+from django.template import loader
+
+CHUNK_SIZE = 500
+
+
+class EchoBuffer:
+    def write(self, value):
+        return value
+
+
+def stream(items, row: typing.Callable, header="", footer=""):
+    if header:
+        yield header
+    for item in items.iterator(chunk_size=CHUNK_SIZE):
+        yield row(item)
+    if footer:
+        yield footer
+
+
+def streaming_response(content, content_type: str, filename: str):
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f"attachment; filename=\"{filename}\""
+    return response
+
+
+def totals(items):
+    sums = items.order_by().aggregate(
+        total_incoming=Sum('amount', filter=Q(amount__gte=0)),
+        total_outgoing=Sum('amount', filter=Q(amount__lt=0)),
+    )
+    return (
+        sums['total_incoming'] or decimal.Decimal(0),
+        -(sums['total_outgoing'] or decimal.Decimal(0)),
+    )
+
+
+def csv_export(items, filename: str):
+    fieldnames = ["Transaction ID", "Date", "Time", "Description", "Amount", "Currency"]
+    writer = csv.DictWriter(EchoBuffer(), fieldnames=fieldnames)
+
+    return streaming_response(stream(items, lambda i: writer.writerow({
+        "Transaction ID": i.id,
+        "Date": i.timestamp.date(),
+        "Time": i.timestamp.time(),
+        "Description": i.descriptor,
+        "Amount": i.amount,
+        "Currency": "GBP"
+    }), header=writer.writeheader()), 'text/csv; charset=utf-8', filename)
+
+
+def qif_export(account, items, filename: str):
+    header = loader.get_template("billing/statement_export_qif.txt").render({"account": account})
+    row = loader.get_template("billing/statement_export_qif_row.txt")
+
+    return streaming_response(
+        stream(items, lambda i: row.render({"item": i}), header=header),
+        'application/qif ; charset=utf-8', filename
+    )
+
+
+def pdf_export(request, account, items, context: dict):
+    context = {
+        "account": account,
+        **context,
+    }
+    header = loader.get_template("billing/statement_export_pdf_header.html").render(context, request)
+    row = loader.get_template("billing/statement_export_pdf_row.html")
+    footer = loader.get_template("billing/statement_export_pdf_footer.html").render(context, request)
+
+    return StreamingHttpResponse(
+        stream(items, lambda i: row.render({"item": i}, request), header=header, footer=footer),
+        content_type='text/html; charset=utf-8'
+    )
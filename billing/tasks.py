@@ -1,14 +1,17 @@
+import collections
+import dataclasses
 import datetime
 import decimal
 import json
-import threading
+import functools
+import typing
 import django.core.exceptions
 import google.protobuf.wrappers_pb2
-import pika
 import pywebpush
 import sentry_sdk
 import stripe.error
 from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -19,18 +22,16 @@ from django.utils import timezone
 from . import models, utils, apps, vat, emails
 from .proto import billing_pb2
 
-pika_parameters = pika.URLParameters(settings.RABBITMQ_RPC_URL)
-
 SUBSCRIPTION_RETRY_ATTEMPTS = 3
 SUBSCRIPTION_RETRY_INTERVAL = datetime.timedelta(days=2)
 
 
-def as_thread(fun):
+def as_task(fun):
+    @functools.wraps(fun)
     def new_fun(*args, **kwargs):
-        t = threading.Thread(target=fun, args=args, kwargs=kwargs)
-        t.setDaemon(False)
-        t.start()
+        apps.task_executor.submit(fun, *args, **kwargs)
 
+    new_fun.run = fun
     return new_fun
 
 
@@ -82,7 +83,7 @@ def mail_notif(ledger_item: models.LedgerItem):
     }, user=ledger_item.account.user)
 
 
-@as_thread
+@as_task
 def mail_subscription_success(subscription: models.Subscription, item: models.LedgerItem):
     try:
         charge_state = item.charge_state
@@ -99,7 +100,7 @@ def mail_subscription_success(subscription: models.Subscription, item: models.Le
     }, user=subscription.account.user)
 
 
-@as_thread
+@as_task
 def mail_subscription_past_due(subscription: models.Subscription, item: models.LedgerItem):
     try:
         charge_state = item.charge_state
@@ -116,7 +117,7 @@ def mail_subscription_past_due(subscription: models.Subscription, item: models.L
     }, user=subscription.account.user)
 
 
-@as_thread
+@as_task
 def mail_subscription_cancelled(subscription: models.Subscription, item: models.LedgerItem):
     try:
         charge_state = item.charge_state
@@ -133,7 +134,7 @@ def mail_subscription_cancelled(subscription: models.Subscription, item: models.
     }, user=subscription.account.user)
 
 
-@as_thread
+@as_task
 def alert_account(account: models.Account, ledger_item: models.LedgerItem, new=False, mail=True):
     extra = None
     if ledger_item.type == ledger_item.TYPE_CHARGE:
@@ -350,14 +351,7 @@ def send_charge_state_notif(instance: models.ChargeState):
             ) if instance.last_error else None,
             redirect_url=settings.EXTERNAL_URL_BASE + reverse('complete_order', args=(instance.id,))
         )
-        pika_connection = pika.BlockingConnection(parameters=pika_parameters)
-        pika_channel = pika_connection.channel()
-        pika_channel.basic_publish(
-            exchange='',
-            routing_key=instance.notif_queue,
-            body=msg.SerializeToString()
-        )
-        pika_connection.close()
+        apps.amqp_publisher.publish(instance.notif_queue, msg.SerializeToString())
 
 
 @receiver(post_save, sender=models.ChargeState)
@@ -383,14 +377,7 @@ def send_subscription_notif(instance: models.Subscription, **kwargs):
             subscription_id=instance.id,
             state=status,
         )
-        pika_connection = pika.BlockingConnection(parameters=pika_parameters)
-        pika_channel = pika_connection.channel()
-        pika_channel.basic_publish(
-            exchange='',
-            routing_key=instance.plan.notif_queue,
-            body=msg.SerializeToString()
-        )
-        pika_connection.close()
+        apps.amqp_publisher.publish(instance.plan.notif_queue, msg.SerializeToString())
 
 
 class ChargeError(Exception):
@@ -1014,6 +1001,296 @@ def charge_account(account: models.Account, amount: decimal.Decimal, descriptor:
             return charge_state
 
 
+MAX_CHARGE_BATCH = 1000
+
+
+@dataclasses.dataclass
+class ChargeRequest:
+    account: typing.Optional[models.Account]
+    amount: decimal.Decimal
+    descriptor: str
+    type_id: str
+    can_reject: bool = True
+    off_session: bool = True
+    return_uri: typing.Optional[str] = None
+    notif_queue: typing.Optional[str] = None
+    supports_delayed: bool = True
+
+
+@dataclasses.dataclass
+class ChargeResult:
+    charge_state: typing.Optional[models.ChargeState] = None
+    error: typing.Optional[str] = None
+    redirect_uri: typing.Optional[str] = None
+
+
+def account_vat_rate(account: models.Account) -> decimal.Decimal:
+    if not account.taxable:
+        return decimal.Decimal(0)
+    return vat.get_vat_rate(
+        account.billing_address.country_code.code.lower(), account.billing_address.postal_code
+    ) or decimal.Decimal(0)
+
+
+def charge_from_balance(account: models.Account, charges: typing.List[ChargeRequest],
+                        vat_rate: decimal.Decimal) -> typing.List[models.ChargeState]:
+    billing_address_country = account.billing_address.country_code.code.lower()
+    exchange_rates = {
+        "eur_exchange_rate": models.ExchangeRate.get_rate("gbp", "eur"),
+        "try_exchange_rate": models.ExchangeRate.get_rate("gbp", "try"),
+        "krw_exchange_rate": models.ExchangeRate.get_rate("gbp", "krw"),
+    }
+    now = timezone.now()
+
+    ledger_items = []
+    charge_states = []
+    for charge in charges:
+        ledger_item = models.LedgerItem(
+            account=account,
+            descriptor=charge.descriptor,
+            amount=-charge.amount,
+            type=models.LedgerItem.TYPE_CHARGE,
+            type_id=charge.type_id,
+            timestamp=now,
+            state=models.LedgerItem.STATE_COMPLETED,
+            completed_timestamp=now,
+            last_state_change_timestamp=now,
+        )
+        # Zero value charges are completed as-is, just as attempt_charge_off_session does
+        if charge.amount != 0:
+            ledger_item.amount = -(charge.amount + (charge.amount * vat_rate))
+            ledger_item.vat_rate = vat_rate
+            ledger_item.country_code = billing_address_country
+            ledger_item.evidence_billing_address = account.billing_address
+            for field, rate in exchange_rates.items():
+                setattr(ledger_item, field, rate)
+        ledger_items.append(ledger_item)
+        charge_states.append(models.ChargeState(
+            account=account,
+            ledger_item=ledger_item,
+            return_uri=charge.return_uri,
+            notif_queue=charge.notif_queue,
+            can_reject=charge.can_reject,
+            amount=charge.amount,
+            ready_to_complete=charge.amount != 0,
+        ))
+
+    with transaction.atomic():
+        models.LedgerItem.objects.bulk_create(ledger_items)
+        models.ChargeState.objects.bulk_create(charge_states)
+        models.AccountBalance.apply_ledger_changes([
+            (None, models.AccountBalance.ledger_values(i)) for i in ledger_items
+        ])
+
+    return charge_states
+
+
+def charge_accounts(charges: typing.List[ChargeRequest], mail=True) -> typing.List[ChargeResult]:
+    results = [ChargeResult() for _ in charges]
+    by_account = collections.defaultdict(list)
+    for i, charge in enumerate(charges):
+        by_account[charge.account.id if charge.account else None].append(i)
+
+    for account_id, indexes in by_account.items():
+        account = charges[indexes[0]].account
+        from_balance = []
+        charge_states = []
+
+        # Off-session charges the account's balance fully covers are completed together, VAT and balance are
+        # only worked out once. Anything after the first charge the balance can't cover goes through charge_account.
+        # The account is locked while its balance is spent so concurrent batches can't both spend it.
+        if account and account.billing_address and account.can_sell[0]:
+            try:
+                with transaction.atomic():
+                    models.Account.objects.select_for_update().filter(id=account.id).first()
+                    vat_rate = account_vat_rate(account)
+                    remaining_balance = account.balance
+                    for i in indexes:
+                        charge = charges[i]
+                        charged_amount = charge.amount + (charge.amount * vat_rate)
+                        if not charge.off_session or charged_amount > remaining_balance:
+                            break
+                        remaining_balance -= charged_amount
+                        from_balance.append(i)
+
+                    if from_balance:
+                        charge_states = charge_from_balance(account, [charges[i] for i in from_balance], vat_rate)
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                for i in indexes:
+                    results[i].error = "Unable to process charge"
+                continue
+
+        for i, charge_state in zip(from_balance, charge_states):
+            results[i].charge_state = charge_state
+            # The items were created already completed, so mark them as new for the charge mail and notification
+            charge_state.ledger_item.original_state = None
+            try:
+                try_update_charge_state(charge_state.ledger_item, mail=mail)
+            except Exception as e:
+                # The charge has already been made, so it still succeeded
+                sentry_sdk.capture_exception(e)
+
+        for i in indexes[len(from_balance):]:
+            charge = charges[i]
+            try:
+                with transaction.atomic():
+                    try:
+                        results[i].charge_state = charge_account(
+                            account, charge.amount, charge.descriptor, charge.type_id, can_reject=charge.can_reject,
+                            off_session=charge.off_session, return_uri=charge.return_uri,
+                            notif_queue=charge.notif_queue, supports_delayed=charge.supports_delayed, mail=mail
+                        )
+                    except ChargeError as e:
+                        results[i].charge_state = e.charge_state
+                        results[i].error = e.message
+                    except ChargeStateRequiresActionError as e:
+                        results[i].charge_state = e.charge_state
+                        results[i].redirect_uri = e.redirect_url
+            except Exception as e:
+                # Anything unexpected rolls back just this charge
+                sentry_sdk.capture_exception(e)
+                results[i] = ChargeResult(error="Unable to process charge")
+
+    return results
+
+
+def charge_usage_change(subscription: models.Subscription, charge_diff: decimal.Decimal, timestamp: datetime.datetime,
+                        can_reject=True, off_session=True, return_uri=None) -> typing.Optional[str]:
+    subscription_charge = models.SubscriptionCharge(
+        subscription=subscription,
+        timestamp=timestamp,
+        last_bill_attempted=timestamp,
+        amount=charge_diff,
+    )
+
+    redirect_url = None
+    try:
+        charge_state = charge_account(
+            subscription.account, charge_diff, f"{subscription.plan.name} - change in usage",
+            f"sb_{subscription.id}", can_reject=can_reject, off_session=off_session,
+            return_uri=return_uri, supports_delayed=True
+        )
+    except ChargeStateRequiresActionError as e:
+        ledger_item = e.charge_state.ledger_item
+        redirect_url = e.redirect_url
+    except ChargeError as e:
+        ledger_item = e.charge_state.ledger_item
+    else:
+        ledger_item = charge_state.ledger_item
+
+    subscription_charge.last_ledger_item = ledger_item
+    subscription_charge.save()
+    ledger_item.subscription_charge = subscription_charge
+    ledger_item.save(mail=True, force_mail=True)
+
+    return redirect_url
+
+
+MAX_USAGE_BATCH = 10000
+
+
+@dataclasses.dataclass
+class UsageRecord:
+    subscription_id: str
+    usage_units: int
+    timestamp: datetime.datetime
+
+
+@dataclasses.dataclass
+class UsageBatchResult:
+    accepted: int = 0
+    errors: typing.Dict[int, str] = dataclasses.field(default_factory=dict)
+    redirect_uris: typing.Dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+def parse_usage_record(subscription_id, usage, timestamp=None) -> UsageRecord:
+    try:
+        subscription_id = str(models.Subscription._meta.pk.to_python(subscription_id))
+    except django.core.exceptions.ValidationError:
+        raise ValueError("Invalid subscription ID")
+
+    try:
+        usage_units = int(usage)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid usage")
+    if usage_units < 0:
+        raise ValueError("Usage must not be negative")
+
+    if timestamp is None:
+        timestamp = timezone.now()
+    elif not isinstance(timestamp, datetime.datetime):
+        try:
+            timestamp = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise ValueError("Invalid timestamp")
+
+    return UsageRecord(subscription_id=subscription_id, usage_units=usage_units, timestamp=timestamp)
+
+
+def log_usage_batch(records: typing.List[typing.Tuple[int, UsageRecord]], can_reject=True, off_session=True,
+                    return_uri=None) -> UsageBatchResult:
+    result = UsageBatchResult()
+    by_subscription = collections.defaultdict(list)
+    for i, record in records:
+        by_subscription[record.subscription_id].append((i, record))
+
+    known_subscriptions = set(
+        str(s) for s in models.Subscription.objects.filter(id__in=list(by_subscription.keys()))
+        .values_list('id', flat=True)
+    )
+
+    for subscription_id, subscription_records in by_subscription.items():
+        if subscription_id not in known_subscriptions:
+            for i, _ in subscription_records:
+                result.errors[i] = "Subscription not found"
+            continue
+
+        try:
+            with transaction.atomic():
+                subscription = models.Subscription.objects.select_for_update().select_related('plan', 'account') \
+                    .get(id=subscription_id)
+                old_usage = subscription.subscriptionusage_set.first()
+                period = None
+                if subscription.plan.billing_type == models.RecurringPlan.TYPE_METERED:
+                    period = models.SubscriptionUsagePeriod.current(subscription)
+
+                usages = models.SubscriptionUsage.objects.bulk_create([
+                    models.SubscriptionUsage(
+                        subscription=subscription,
+                        timestamp=record.timestamp,
+                        usage_units=record.usage_units,
+                    ) for _, record in subscription_records
+                ])
+                if period:
+                    period.record([u for u in usages if u.timestamp > subscription.last_billed])
+
+                # A recurring plan is charged for the difference between the usage before and after the whole batch
+                if subscription.plan.billing_type == models.RecurringPlan.TYPE_RECURRING:
+                    latest = max(usages + ([old_usage] if old_usage else []), key=lambda u: u.timestamp)
+                    new_charge, old_charge = subscription.plan.calculate_charges([
+                        latest.usage_units, old_usage.usage_units if old_usage else 0
+                    ])
+                    charge_diff = new_charge - old_charge
+                    if charge_diff != 0:
+                        redirect_url = charge_usage_change(
+                            subscription, charge_diff, latest.timestamp, can_reject=can_reject, off_session=off_session,
+                            return_uri=return_uri
+                        )
+                        if redirect_url:
+                            result.redirect_uris[subscription_id] = redirect_url
+        except Exception as e:
+            # Only this subscription's records are rolled back, so a retry of just these won't double count
+            sentry_sdk.capture_exception(e)
+            for i, _ in subscription_records:
+                result.errors[i] = "Unable to record usage"
+            continue
+
+        result.accepted += len(subscription_records)
+
+    return result
+
+
 def process_ledger_item_refund(ledger_item: models.LedgerItem, amount: decimal.Decimal):
     if ledger_item.type == ledger_item.TYPE_GIROPAY:
         payment_intent = stripe.PaymentIntent.retrieve(ledger_item.type_id)
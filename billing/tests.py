@@ -1,3 +1,341 @@
-from django.test import TestCase
+import base64
+import datetime
+import decimal
+import json
+import time
+from unittest import mock, skipUnless
+import requests
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from . import api_auth, models
 
-# Create your tests here.
+# Markers CockroachDB and PostgreSQL use for a scan of the whole table
+FULL_SCAN_MARKERS = ("FULL SCAN", "Seq Scan")
+
+
+class AccountBalanceTestCase(TestCase):
+    def setUp(self):
+        self.account = get_user_model().objects.create(username="balance-test").account
+
+    def add_item(self, amount, state=models.LedgerItem.STATE_COMPLETED, **kwargs):
+        item = models.LedgerItem(
+            account=self.account,
+            descriptor="Test",
+            amount=decimal.Decimal(amount),
+            type=models.LedgerItem.TYPE_MANUAL,
+            timestamp=timezone.now(),
+            state=state,
+            **kwargs
+        )
+        item.save(mail=False)
+        return item
+
+    def assertBalancesMatchLedger(self):
+        expected = {k: v for k, v in models.AccountBalance.ledger_totals().items() if v}
+        actual = {
+            (b.account_id, b.bucket): b.amount for b in models.AccountBalance.objects.all() if b.amount
+        }
+        self.assertEqual(actual, expected)
+
+    def test_create(self):
+        self.add_item("10.00")
+        self.add_item("-2.50")
+        self.add_item("5.00", state=models.LedgerItem.STATE_PENDING)
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.balance, decimal.Decimal("7.50"))
+        self.assertEqual(self.account.pending_balance, decimal.Decimal("5.00"))
+
+    def test_update_amount(self):
+        item = self.add_item("10.00")
+        item.amount = decimal.Decimal("12.00")
+        item.save(mail=False)
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.balance, decimal.Decimal("12.00"))
+
+    def test_state_change(self):
+        item = self.add_item("10.00", state=models.LedgerItem.STATE_PENDING)
+        item.state = models.LedgerItem.STATE_COMPLETED
+        item.save(mail=False)
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.balance, decimal.Decimal("10.00"))
+        self.assertEqual(self.account.pending_balance, decimal.Decimal(0))
+
+    def test_bulk_state_change(self):
+        self.add_item("10.00", state=models.LedgerItem.STATE_PENDING)
+        self.add_item("5.00", state=models.LedgerItem.STATE_PENDING)
+        models.LedgerItem.objects.filter(account=self.account).set_state(models.LedgerItem.STATE_FAILED)
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.pending_balance, decimal.Decimal(0))
+
+    def test_reversal(self):
+        self.add_item("10.00")
+        self.add_item("-4.00", is_reversal=True)
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.reversal_balance, decimal.Decimal("-4.00"))
+
+    def test_delete(self):
+        self.add_item("10.00")
+        item = self.add_item("3.00")
+        item.delete()
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.balance, decimal.Decimal("10.00"))
+
+    def test_bulk_delete(self):
+        self.add_item("10.00")
+        self.add_item("3.00")
+        self.add_item("-1.00", is_reversal=True)
+        models.LedgerItem.objects.filter(account=self.account).delete()
+        self.assertBalancesMatchLedger()
+        self.assertEqual(self.account.balance, decimal.Decimal(0))
+
+    def test_closed_month_invalidated(self):
+        last_year = timezone.now() - datetime.timedelta(days=400)
+        item = self.add_item("10.00")
+        item.timestamp = last_year
+        item.save(mail=False)
+        models.DeferralPeriod.report()
+        month = models.DeferralPeriod.month_of(last_year)
+        self.assertTrue(models.DeferralPeriod.objects.filter(month=month).exists())
+
+        models.LedgerItem.objects.filter(pk=item.pk).delete()
+        self.assertFalse(models.DeferralPeriod.objects.filter(month=month).exists())
+
+
+@skipUnless(connection.vendor in ("postgresql", "cockroachdb"), "Query plans are only checked on the server databases")
+class QueryPlanTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        accounts = [
+            get_user_model().objects.create(username=f"plan-test-{i}").account for i in range(10)
+        ]
+        models.LedgerItem.objects.bulk_create([
+            models.LedgerItem(
+                account=accounts[i % len(accounts)],
+                descriptor="Test",
+                amount=decimal.Decimal(i),
+                type=(models.LedgerItem.TYPE_CHARGE, models.LedgerItem.TYPE_CARD, models.LedgerItem.TYPE_BACS)[i % 3],
+                type_id=f"ref-{i}",
+                timestamp=now - datetime.timedelta(hours=i),
+                last_state_change_timestamp=now - datetime.timedelta(hours=i),
+                state=(models.LedgerItem.STATE_COMPLETED, models.LedgerItem.STATE_PENDING)[i % 2],
+                country_code="gb",
+            ) for i in range(500)
+        ])
+        plan = models.RecurringPlan.objects.create(
+            name="Test", unit_label="unit", billing_interval_value=1,
+            billing_interval_unit=models.RecurringPlan.INTERVAL_MONTH,
+            billing_type=models.RecurringPlan.TYPE_RECURRING, tiers_type=models.RecurringPlan.TIERS_VOLUME,
+        )
+        cls.account = accounts[0]
+        cls.subscription = models.Subscription.objects.create(
+            plan=plan, account=cls.account, last_billed=now, next_bill=now + datetime.timedelta(days=30),
+            state=models.Subscription.STATE_ACTIVE,
+        )
+
+    def setUp(self):
+        # Tables this small are cheap enough to scan whole, so make the planner show whether an index is usable
+        with connection.cursor() as cursor:
+            if connection.vendor == "cockroachdb":
+                cursor.execute("SET disallow_full_table_scans = on")
+                cursor.execute("SET large_full_scan_rows = 0")
+            else:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertIndexed(self, queryset, expected_index):
+        plan = queryset.explain()
+        self.assertFalse(
+            any(marker in plan for marker in FULL_SCAN_MARKERS),
+            f"Expected a scan of {expected_index}, got:\n{plan}"
+        )
+
+    def test_ledger_by_account_and_state(self):
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            account=self.account, state=models.LedgerItem.STATE_COMPLETED
+        ), "billing_ledger_acct_state_idx")
+
+    def test_ledger_by_account_and_time(self):
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            account=self.account, timestamp__gte=timezone.now() - datetime.timedelta(days=30)
+        ).order_by('-timestamp'), "billing_ledger_acct_time_idx")
+
+    def test_ledger_by_type_reference(self):
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            type=models.LedgerItem.TYPE_CARD, type_id="ref-1"
+        ), "billing_ledger_type_id_idx")
+
+    def test_bank_transfer_reference(self):
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            type=models.LedgerItem.TYPE_BACS, state=models.LedgerItem.STATE_PENDING, type_id__in=["ref-2"]
+        ), "billing_ledger_type_id_idx")
+
+    def test_stale_pending_charges(self):
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            type=models.LedgerItem.TYPE_CHARGE, state=models.LedgerItem.STATE_PENDING,
+            last_state_change_timestamp__lt=timezone.now() - datetime.timedelta(days=7)
+        ), "billing_ledger_stale_idx")
+
+    def test_open_payments(self):
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            state__in=(
+                models.LedgerItem.STATE_PENDING, models.LedgerItem.STATE_PROCESSING_CANCELLABLE,
+                models.LedgerItem.STATE_PROCESSING,
+            ),
+            type=models.LedgerItem.TYPE_GOCARDLESS,
+        ).order_by('timestamp'), "billing_ledger_open_idx")
+
+    def test_vat_period(self):
+        now = timezone.now()
+        self.assertIndexed(models.LedgerItem.objects.filter(
+            state=models.LedgerItem.STATE_COMPLETED, type=models.LedgerItem.TYPE_CHARGE,
+            country_code="gb", timestamp__gte=now - datetime.timedelta(days=90), timestamp__lte=now,
+        ), "billing_ledger_vat_idx")
+
+    def test_subscription_usage(self):
+        self.assertIndexed(models.SubscriptionUsage.objects.filter(
+            subscription=self.subscription, timestamp__gt=timezone.now() - datetime.timedelta(days=30)
+        ), "billing_usage_sub_time_idx")
+
+    def test_subscription_charges(self):
+        self.assertIndexed(models.SubscriptionCharge.objects.filter(
+            subscription=self.subscription
+        ).order_by('-timestamp'), "billing_charge_sub_time_idx")
+
+    def test_due_subscriptions(self):
+        self.assertIndexed(models.Subscription.objects.filter(
+            state__in=(models.Subscription.STATE_ACTIVE, models.Subscription.STATE_PAST_DUE),
+            next_bill__lte=timezone.now(),
+        ), "billing_subscription_due_idx")
+
+    def test_pending_webhooks(self):
+        self.assertIndexed(models.WebhookEvent.objects.filter(
+            state=models.WebhookEvent.STATE_PENDING
+        ).order_by('received_at'), "billing_webhook_pending_idx")
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+@override_settings(KEYCLOAK_SERVER_URL="https://sso.example.com/", KEYCLOAK_REALM="test", API_TOKEN_CACHE_SIZE=100)
+class TokenVerifierTestCase(SimpleTestCase):
+    issuer = "https://sso.example.com/realms/test"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def setUp(self):
+        self.verifier = api_auth.TokenVerifier()
+        self.verifier._keys = {"key-1": self.private_key.public_key()}
+        self.verifier._keys_fetched = time.monotonic()
+        # Don't start the background key rotation in tests
+        self.verifier._rotator = True
+
+    def make_token(self, header=None, **claims):
+        header = {"alg": "RS256", "kid": "key-1", "typ": "JWT", **(header or {})}
+        payload = {"iss": self.issuer, "sub": "user", "exp": time.time() + 300, **claims}
+        signing_input = f"{b64encode(json.dumps(header).encode())}.{b64encode(json.dumps(payload).encode())}"
+        signature = self.private_key.sign(signing_input.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return f"{signing_input}.{b64encode(signature)}"
+
+    def test_valid(self):
+        claims = self.verifier.verify(self.make_token(sub="someone"))
+        self.assertEqual(claims["sub"], "someone")
+
+    def test_bad_signature(self):
+        header, payload, _ = self.make_token().split(".")
+        _, _, other_signature = self.make_token(sub="other").split(".")
+        with self.assertRaises(api_auth.InvalidToken):
+            self.verifier.verify(f"{header}.{payload}.{other_signature}")
+
+    def test_tampered_payload(self):
+        header, _, signature = self.make_token().split(".")
+        payload = b64encode(json.dumps({"iss": self.issuer, "sub": "admin", "exp": time.time() + 300}).encode())
+        with self.assertRaises(api_auth.InvalidToken):
+            self.verifier.verify(f"{header}.{payload}.{signature}")
+
+    def test_malformed(self):
+        for token in ("", "abc", "a.b", "a.b.c.d", "!!.!!.!!"):
+            with self.assertRaises(api_auth.InvalidToken):
+                self.verifier.verify_locally(token)
+
+    def test_expired(self):
+        with self.assertRaises(api_auth.InvalidToken):
+            self.verifier.verify(self.make_token(exp=time.time() - 1))
+
+    def test_missing_exp(self):
+        with self.assertRaises(api_auth.InvalidToken):
+            self.verifier.verify(self.make_token(exp=None))
+
+    def test_not_yet_valid(self):
+        with self.assertRaises(api_auth.InvalidToken):
+            self.verifier.verify(self.make_token(nbf=time.time() + 60))
+        self.verifier.verify(self.make_token(nbf=time.time() - 60))
+
+    def test_wrong_issuer(self):
+        with self.assertRaises(api_auth.UnverifiableToken):
+            self.verifier.verify_locally(self.make_token(iss="https://evil.example.com/realms/test"))
+
+    def test_unsupported_algorithm(self):
+        with self.assertRaises(api_auth.UnverifiableToken):
+            self.verifier.verify_locally(self.make_token(header={"alg": "HS256"}))
+        with self.assertRaises(api_auth.UnverifiableToken):
+            self.verifier.verify_locally(self.make_token(header={"alg": ["RS256"]}))
+
+    def test_non_string_kid(self):
+        with self.assertRaises(api_auth.InvalidToken):
+            self.verifier.verify(self.make_token(header={"kid": ["key-1"]}))
+
+    def test_unverifiable_falls_back_to_keycloak(self):
+        token = self.make_token(iss="https://other.example.com/realms/test")
+        with mock.patch("django_keycloak_auth.clients.verify_token", return_value={"sub": "remote"}) as verify:
+            self.assertEqual(self.verifier.verify(token), {"sub": "remote"})
+        verify.assert_called_once_with(token)
+
+    def test_cached(self):
+        token = self.make_token()
+        self.verifier.verify(token)
+        with mock.patch.object(self.verifier, "verify_locally") as verify_locally:
+            self.verifier.verify(token)
+        verify_locally.assert_not_called()
+
+    def test_cache_expiry(self):
+        token = self.make_token(exp=time.time() + 300)
+        self.verifier.verify(token)
+        with mock.patch("time.time", return_value=time.time() + 600):
+            with self.assertRaises(api_auth.InvalidToken):
+                self.verifier.verify(token)
+
+    @override_settings(API_TOKEN_CACHE_SIZE=2)
+    def test_cache_eviction(self):
+        tokens = [self.make_token(sub=f"user-{i}") for i in range(3)]
+        for token in tokens:
+            self.verifier.verify(token)
+        self.assertEqual(len(self.verifier._claims), 2)
+
+        with mock.patch.object(self.verifier, "verify_locally", wraps=self.verifier.verify_locally) as verify_locally:
+            self.verifier.verify(tokens[2])
+            verify_locally.assert_not_called()
+            self.verifier.verify(tokens[0])
+            verify_locally.assert_called_once()
+
+    def test_unknown_key_refetch_throttled(self):
+        with mock.patch.object(self.verifier, "_fetch_keys") as fetch_keys:
+            with self.assertRaises(api_auth.UnverifiableToken):
+                self.verifier.verify_locally(self.make_token(header={"kid": "key-2"}))
+        fetch_keys.assert_not_called()
+
+    def test_unreachable_keycloak_throttled(self):
+        self.verifier._keys = None
+        self.verifier._keys_fetched = None
+        with mock.patch.object(self.verifier, "_fetch_keys", side_effect=requests.ConnectionError) as fetch_keys:
+            for _ in range(3):
+                with self.assertRaises(api_auth.UnverifiableToken):
+                    self.verifier.verify_locally(self.make_token())
+        fetch_keys.assert_called_once()
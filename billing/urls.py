@@ -78,10 +78,12 @@ urlpatterns = [
     path('coinbase_webhook/', views.webhooks.coinbase_webhook),
     path('monzo_webhook/<secret_key>/', views.webhooks.monzo_webhook),
     path('charge_user/<user_id>/', views.api.charge_user),
+    path('charge_users/', views.api.charge_users),
     path('get_charge_state/<str:charge_state_id>/', views.api.get_charge_state),
     path('reverse_charge/', views.api.reverse_charge),
     path('subscribe_user/<user_id>/', views.api.subscribe_user),
     path('log_usage/<subscription_id>/', views.api.log_usage),
+    path('log_usage_batch/', views.api.log_usage_batch),
     path('convert_currency/', views.api.convert_currency),
     path('save_subscription/', views.save_subscription),
     path('sw.js', views.sw),
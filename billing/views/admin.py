@@ -1,17 +1,15 @@
 import datetime
 import decimal
 
-import dateutil.relativedelta
 import django_countries
-import pytz
 import calendar
 import stripe
 import stripe.error
 import schwifty
-from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, permission_required
-from django.db.models import DecimalField, OuterRef, Sum, Subquery
+from django.db.models import Sum
+from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 
 from .. import forms, models, tasks, vat, nb
@@ -21,21 +19,18 @@ from ..views import webhooks
 @login_required
 @permission_required('billing.view_account', raise_exception=True)
 def view_accounts(request):
-    accounts = models.Account.objects.all()
-
-    balances = models.LedgerItem.objects.filter(account=OuterRef('pk')) \
-        .filter(state=models.LedgerItem.STATE_COMPLETED) \
-        .order_by().values('account') \
-        .annotate(balance=Sum('amount', output_field=DecimalField())) \
-        .values('balance')
-    total_balance = models.Account.objects \
-                        .filter(exclude_from_accounting=False) \
-                        .annotate(balance=Subquery(balances, output_field=DecimalField())) \
-                        .aggregate(total_balance=Sum('balance')).get('total_balance') or decimal.Decimal(0)
+    accounts = models.Account.objects.with_balances().order_by('user__username')
+    accounts = Paginator(accounts, 100)
+    page_number = request.GET.get('page')
+    page_obj = accounts.get_page(page_number)
+
+    total_balance = models.AccountBalance.objects \
+                        .filter(account__exclude_from_accounting=False, bucket=models.LedgerItem.STATE_COMPLETED) \
+                        .aggregate(total_balance=Sum('amount')).get('total_balance') or decimal.Decimal(0)
     has_freeagent_auth = bool(models.BillingConfig.load().get_freeagent_token())
 
     return render(request, "billing/accounts.html", {
-        "accounts": accounts,
+        "accounts": page_obj,
         "total_balance": total_balance,
         "has_freeagent_auth":  has_freeagent_auth
     })
@@ -70,6 +65,7 @@ def view_account(request, account_id):
 
     return render(request, "billing/account.html", {
         "account": account,
+        "ledger_items": account.ledgeritem_set.with_running_balance(),
         "cards": cards,
         "bacs_mandates": bacs_mandates,
         "sepa_mandates": sepa_mandates,
@@ -227,45 +223,8 @@ def add_bank_account(request, account_id):
 @login_required
 @permission_required('billing.view_ledgeritem', raise_exception=True)
 def view_account_deferrals(request):
-    start_date = datetime.datetime(2020, 1, 1, tzinfo=pytz.timezone("Europe/London"))
-    end_date = datetime.datetime.utcnow().astimezone(pytz.timezone("Europe/London"))
-
-    ledger_items = models.LedgerItem.objects.filter(
-        state=models.LedgerItem.STATE_COMPLETED,
-        account__exclude_from_accounting=False
-    ).filter(
-        ~Q(type=models.LedgerItem.TYPE_MANUAL)
-    )
-
-    reporting_periods = []
-    cur_start_date = start_date
-    delta = dateutil.relativedelta.relativedelta(months=1)
-    while True:
-        period_items = ledger_items.filter(
-            timestamp__gte=cur_start_date,
-            timestamp__lt=cur_start_date + delta
-        )
-        sales = decimal.Decimal(0)
-        prepayments = decimal.Decimal(0)
-        for item in period_items:
-            if item.amount < 0:
-                sales += item.amount
-            else:
-                prepayments += item.amount
-
-        reporting_periods.append({
-            "start_date": cur_start_date.date(),
-            "end_date": (cur_start_date + delta).date() - dateutil.relativedelta.relativedelta(days=1),
-            "sales": sales,
-            "prepayments": prepayments
-        })
-
-        cur_start_date += delta
-        if cur_start_date >= end_date:
-            break
-
     return render(request, "billing/account_deferrals.html", {
-        "reporting_periods": reversed(reporting_periods)
+        "reporting_periods": models.DeferralPeriod.report()
     })
 
 
@@ -305,13 +264,10 @@ def view_vat_gb(request):
                 account__exclude_from_accounting=False
             )
             months = {}
-            for item in items:
-                if item.timestamp.month not in months:
-                    months[item.timestamp.month] = {}
-                vat_rate = str(item.vat_rate)
-                if vat_rate not in months[item.timestamp.month]:
-                    months[item.timestamp.month][vat_rate] = decimal.Decimal(0)
-                months[item.timestamp.month][vat_rate] += -item.amount
+            for (_, month, vat_rate), total in items.vat_totals().items():
+                months.setdefault(month, {})
+                vat_rate = str(vat_rate)
+                months[month][vat_rate] = months[month].get(vat_rate, decimal.Decimal(0)) + total["gbp"]
 
             def map_vat_rate(v):
                 rate = decimal.Decimal(v[0])
@@ -378,22 +334,15 @@ def view_vat_tr(request):
                 account__exclude_from_accounting=False
             )
             vat_rates = {}
-            for item in items:
-                vat_rate = str(item.vat_rate)
+            for (_, _, vat_rate), total in items.vat_totals("try").items():
+                vat_rate = str(vat_rate)
                 if vat_rate not in vat_rates:
                     vat_rates[vat_rate] = {
                         "gbp": decimal.Decimal(0),
                         "try": decimal.Decimal(0),
                     }
-
-                if item.try_exchange_rate:
-                    exchange_rate = item.try_exchange_rate
-                elif item.reversal_for and item.reversal_for.try_exchange_rate:
-                    exchange_rate = item.reversal_for.try_exchange_rate
-                else:
-                    exchange_rate = models.ExchangeRate.get_rate("gbp", "try")
-                vat_rates[vat_rate]["gbp"] += -item.amount
-                vat_rates[vat_rate]["try"] += -item.amount * exchange_rate
+                vat_rates[vat_rate]["gbp"] += total["gbp"]
+                vat_rates[vat_rate]["try"] += total["converted"]
 
             def map_vat_rate(v):
                 rate = decimal.Decimal(v[0])
@@ -458,26 +407,11 @@ def view_vat_moss(request):
                 account__exclude_from_accounting=False
             )
             countries = {}
-            for item in items:
-                if item.country_code not in countries:
-                    countries[item.country_code] = {}
-                if item.timestamp.month not in countries[item.country_code]:
-                    countries[item.country_code][item.timestamp.month] = {}
-                vat_rate = str(item.vat_rate)
-                if vat_rate not in countries[item.country_code][item.timestamp.month]:
-                    countries[item.country_code][item.timestamp.month][vat_rate] = {
-                        "gbp": decimal.Decimal(0),
-                        "eur": decimal.Decimal(0),
-                    }
-                if item.eur_exchange_rate:
-                    exchange_rate = item.eur_exchange_rate
-                elif item.reversal_for and item.reversal_for.eur_exchange_rate:
-                    exchange_rate = item.reversal_for.eur_exchange_rate
-                else:
-                    exchange_rate = models.ExchangeRate.get_rate("gbp", "eur")
-                countries[item.country_code][item.timestamp.month][vat_rate]["gbp"] += -item.amount
-                countries[item.country_code][item.timestamp.month][vat_rate]["eur"]\
-                    += -item.amount * exchange_rate
+            for (country_code, month, vat_rate), total in items.vat_totals("eur").items():
+                countries.setdefault(country_code, {}).setdefault(month, {})[str(vat_rate)] = {
+                    "gbp": total["gbp"],
+                    "eur": total["converted"],
+                }
 
             def map_vat_rate(v):
                 rate = decimal.Decimal(v[0])
@@ -582,23 +516,11 @@ def view_vat_kr(request):
                 account__exclude_from_accounting=False
             )
             months = {}
-            for item in items:
-                if item.timestamp.month not in months:
-                    months[item.timestamp.month] = {}
-                vat_rate = str(item.vat_rate)
-                if vat_rate not in months[item.timestamp.month]:
-                    months[item.timestamp.month][vat_rate] = {
-                        "gbp": decimal.Decimal(0),
-                        "krw": decimal.Decimal(0),
-                    }
-                if item.krw_exchange_rate:
-                    exchange_rate = item.krw_exchange_rate
-                elif item.reversal_for and item.reversal_for.krw_exchange_rate:
-                    exchange_rate = item.reversal_for.krw_exchange_rate
-                else:
-                    exchange_rate = models.ExchangeRate.get_rate("gbp", "krw")
-                months[item.timestamp.month][vat_rate]["gbp"] += -item.amount
-                months[item.timestamp.month][vat_rate]["krw"] += -item.amount * exchange_rate
+            for (_, month, vat_rate), total in items.vat_totals("krw").items():
+                months.setdefault(month, {})[str(vat_rate)] = {
+                    "gbp": total["gbp"],
+                    "krw": total["converted"],
+                }
 
             def map_vat_rate(v):
                 rate = decimal.Decimal(v[0])
@@ -3,7 +3,6 @@ import decimal
 import json
 import uuid
 
-import django_keycloak_auth.clients
 import keycloak.exceptions
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -14,7 +13,7 @@ from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from idempotency_key.decorators import idempotency_key
-from .. import models, tasks
+from .. import models, tasks, api_auth
 
 
 def check_api_auth(request):
@@ -23,10 +22,10 @@ def check_api_auth(request):
         return HttpResponseForbidden()
 
     try:
-        claims = django_keycloak_auth.clients.verify_token(
+        claims = api_auth.verifier.verify(
             auth[len("Bearer "):].strip()
         )
-    except keycloak.exceptions.KeycloakClientError:
+    except (keycloak.exceptions.KeycloakClientError, api_auth.InvalidToken):
         return HttpResponseForbidden()
 
     if "charge-user" not in claims.get("resource_access", {}).get(
@@ -324,41 +323,15 @@ def log_usage(request, subscription_id):
         subscription_usage.save()
 
         if subscription.plan.billing_type == models.RecurringPlan.TYPE_RECURRING:
-            charge_diff = subscription.plan.calculate_charge(
-                usage_units
-            ) - subscription.plan.calculate_charge(
-                old_usage.usage_units
-            )
+            new_charge, old_charge = subscription.plan.calculate_charges([usage_units, old_usage.usage_units])
+            charge_diff = new_charge - old_charge
 
             if charge_diff != 0:
-                subscription_charge = models.SubscriptionCharge(
-                    subscription=subscription,
-                    timestamp=now,
-                    last_bill_attempted=now,
-                    amount=charge_diff,
+                redirect_url = tasks.charge_usage_change(
+                    subscription, charge_diff, now, can_reject=can_reject, off_session=off_session,
+                    return_uri=data.get("return_uri")
                 )
 
-                redirect_url = None
-                try:
-                    charge_state = tasks.charge_account(
-                        subscription.account, charge_diff, f"{subscription.plan.name} - change in usage",
-                        f"sb_{subscription.id}", can_reject=can_reject, off_session=off_session,
-                        return_uri=data.get("return_uri"), supports_delayed=True
-                    )
-
-                except tasks.ChargeStateRequiresActionError as e:
-                    ledger_item = e.charge_state.ledger_item
-                    redirect_url = e.redirect_url
-                except tasks.ChargeError as e:
-                    ledger_item = e.charge_state.ledger_item
-                else:
-                    ledger_item = charge_state.ledger_item
-
-                subscription_charge.last_ledger_item = ledger_item
-                subscription_charge.save()
-                ledger_item.subscription_charge = subscription_charge
-                ledger_item.save(mail=True, force_mail=True)
-
                 if redirect_url:
                     return HttpResponse(json.dumps({
                         "redirect_uri": redirect_url,
@@ -366,3 +339,112 @@ def log_usage(request, subscription_id):
 
         return HttpResponse(status=200)
 
+
+@csrf_exempt
+@require_POST
+@idempotency_key(optional=True)
+def charge_users(request):
+    auth_error = check_api_auth(request)
+    if auth_error:
+        return auth_error
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest()
+
+    items = data.get("charges") if isinstance(data, dict) else data
+    if not isinstance(items, list) or len(items) > tasks.MAX_CHARGE_BATCH:
+        return HttpResponseBadRequest()
+
+    accounts = {
+        a.user.username: a for a in models.Account.objects.filter(
+            user__username__in=[str(i.get("user_id")) for i in items if isinstance(i, dict)]
+        ).select_related('user', 'billing_address')
+    }
+
+    charges = []
+    errors = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or any(k not in item for k in ("user_id", "amount", "descriptor", "id")):
+            errors[i] = "Missing user_id, amount, descriptor or id"
+            continue
+        try:
+            amount = decimal.Decimal(item["amount"]) / decimal.Decimal(100)
+        except (decimal.InvalidOperation, TypeError, ValueError):
+            errors[i] = "Invalid amount"
+            continue
+        charges.append((i, tasks.ChargeRequest(
+            account=accounts.get(str(item["user_id"])),
+            amount=amount,
+            descriptor=item["descriptor"],
+            type_id=item["id"],
+            can_reject=item.get("can_reject", True),
+            off_session=item.get("off_session", True),
+            return_uri=item.get("return_uri"),
+        )))
+
+    results = dict(zip((i for i, _ in charges), tasks.charge_accounts([c for _, c in charges])))
+
+    response = []
+    for i in range(len(items)):
+        if i in errors:
+            response.append({"result": "invalid", "message": errors[i]})
+            continue
+        result = results[i]
+        item = {"charge_state_id": str(result.charge_state.id) if result.charge_state else None}
+        if result.redirect_uri:
+            item.update({"result": "redirect", "redirect_uri": result.redirect_uri})
+        elif result.error:
+            item.update({"result": "failed", "message": result.error})
+        else:
+            item["result"] = "success"
+        response.append(item)
+
+    return HttpResponse(json.dumps({
+        "results": response,
+    }), content_type='application/json', status=200)
+
+
+@csrf_exempt
+@require_POST
+@idempotency_key(optional=True)
+def log_usage_batch(request):
+    auth_error = check_api_auth(request)
+    if auth_error:
+        return auth_error
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return HttpResponseBadRequest()
+
+    records = data.get("records") if isinstance(data, dict) else data
+    if not isinstance(records, list) or len(records) > tasks.MAX_USAGE_BATCH:
+        return HttpResponseBadRequest()
+
+    parsed = []
+    errors = {}
+    for i, record in enumerate(records):
+        if not isinstance(record, dict) or "subscription_id" not in record or "usage" not in record:
+            errors[i] = "Missing subscription_id or usage"
+            continue
+        try:
+            parsed.append((i, tasks.parse_usage_record(
+                record["subscription_id"], record["usage"], record.get("timestamp")
+            )))
+        except ValueError as e:
+            errors[i] = str(e)
+
+    options = data if isinstance(data, dict) else {}
+    result = tasks.log_usage_batch(
+        parsed, can_reject=options.get("can_reject", True), off_session=options.get("off_session", True),
+        return_uri=options.get("return_uri")
+    )
+    errors.update(result.errors)
+
+    return HttpResponse(json.dumps({
+        "accepted": result.accepted,
+        "errors": [{"index": i, "message": m} for i, m in sorted(errors.items())],
+        "redirect_uris": result.redirect_uris,
+    }), content_type='application/json', status=200)
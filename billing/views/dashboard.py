@@ -1,22 +1,18 @@
-import csv
-
 import stripe
 import stripe.error
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import HttpResponseBadRequest, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template import loader
 from django.core.paginator import Paginator
 import datetime
-import decimal
 from django.db.models import Q
-from .. import forms, models, tasks
+from .. import forms, models, tasks, statements
 from ..apps import gocardless_client
 
 
 @login_required
 def dashboard(request):
-    ledger_items = models.LedgerItem.objects.filter(account=request.user.account)
+    ledger_items = models.LedgerItem.objects.filter(account=request.user.account).with_running_balance()
     active_subscriptions = reversed(sorted(list(request.user.account.subscription_set.filter(
         Q(state=models.Subscription.STATE_ACTIVE) | Q(state=models.Subscription.STATE_PAST_DUE)
     )), key=lambda s: s.next_bill))
@@ -53,60 +49,28 @@ def statement_export(request):
                 timestamp__lte=to_datetime,
                 state=models.LedgerItem.STATE_COMPLETED
             )
+            filename = f"glauca-transactions-{from_date}-{to_date}"
             if form.cleaned_data["format"] == forms.StatementExportForm.FORMAT_CSV:
-                response = HttpResponse(content_type='text/csv; charset=utf-8')
-                response['Content-Disposition'] = \
-                    f"attachment; filename=\"glauca-transactions-{from_date}-{to_date}.csv\""
-
-                fieldnames = ["Transaction ID", "Date", "Time", "Description", "Amount", "Currency"]
-                writer = csv.DictWriter(response, fieldnames=fieldnames)
-                writer.writeheader()
-
-                writer.writerows(map(lambda i: {
-                    "Transaction ID": i.id,
-                    "Date": i.timestamp.date(),
-                    "Time": i.timestamp.time(),
-                    "Description": i.descriptor,
-                    "Amount": i.amount,
-                    "Currency": "GBP"
-                }, items))
-
-                return response
+                return statements.csv_export(items, f"{filename}.csv")
             elif form.cleaned_data["format"] == forms.StatementExportForm.FORMAT_QIF:
-                response = HttpResponse(content_type='application/qif ; charset=utf-8')
-                response['Content-Disposition'] = \
-                    f"attachment; filename=\"glauca-transactions-{from_date}-{to_date}.qif\""
-
-                t = loader.get_template("billing/statement_export_qif.txt")
-                response.write(t.render({
-                    "account": request.user.account,
-                    "items": items
-                }))
-
-                return response
+                return statements.qif_export(request.user.account, items, f"{filename}.qif")
             elif form.cleaned_data["format"] == forms.StatementExportForm.FORMAT_PDF:
-                starting_balance = request.user.account.balance_at(from_datetime)
-                closing_balance = request.user.account.balance_at(to_datetime)
-
-                total_incoming = decimal.Decimal(0)
-                total_outgoing = decimal.Decimal(0)
-
-                for item in items:
-                    if item.amount >= 0:
-                        total_incoming += item.amount
-                    else:
-                        total_outgoing -= item.amount
-
-                return render(request, "billing/statement_export_pdf.html", {
-                    "account": request.user.account,
-                    "items": reversed(items),
-                    "from_date": from_date,
-                    "to_date": to_date,
-                    "starting_balance": starting_balance,
-                    "closing_balance": closing_balance,
-                    "total_incoming": total_incoming,
-                    "total_outgoing": total_outgoing,
-                })
+                starting_balance, closing_balance = request.user.account.ledgeritem_set.statement_balances(
+                    from_datetime, to_datetime
+                )
+                total_incoming, total_outgoing = statements.totals(items)
+
+                return statements.pdf_export(
+                    request, request.user.account,
+                    items.with_running_balance(starting_balance).order_by('timestamp'), {
+                        "from_date": from_date,
+                        "to_date": to_date,
+                        "starting_balance": starting_balance,
+                        "closing_balance": closing_balance,
+                        "total_incoming": total_incoming,
+                        "total_outgoing": total_outgoing,
+                    }
+                )
     else:
         form = forms.StatementExportForm()
 
@@ -2,10 +2,12 @@ import base64
 import binascii
 import datetime
 import decimal
+import hashlib
 import hmac
 import re
 import typing
 import json
+import traceback
 
 import cryptography.exceptions
 import cryptography.hazmat.backends
@@ -23,7 +25,7 @@ from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-from .. import tasks, models, emails
+from .. import tasks, models, emails, bank_refs
 
 transferwise_live_pub = cryptography.hazmat.primitives.serialization.load_der_public_key(
     base64.b64decode(
@@ -63,6 +65,16 @@ wise_api = pywisetransfer.Client(
 )
 
 
+STRIPE_EVENT_TYPES = (
+    'payment_intent.succeeded', 'payment_intent.payment_failed', 'payment_intent.processing',
+    'payment_intent.canceled', 'payment_intent.requires_action', 'source.failed', 'source.chargeable',
+    'source.canceled', 'charge.pending', 'charge.succeeded', 'charge.failed', 'charge.refunded',
+    'charge.refund.updated', 'checkout.session.completed', 'checkout.session.async_payment_failed',
+    'checkout.session.async_payment_succeeded', 'setup_intent.succeeded', 'cash_balance.funds_available',
+    'mandate.updated',
+)
+
+
 @csrf_exempt
 @require_POST
 def stripe_webhook(request):
@@ -78,38 +90,45 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponseBadRequest()
 
-    with transaction.atomic():
-        if event.type in ('payment_intent.succeeded', 'payment_intent.payment_failed', 'payment_intent.processing',
-                          'payment_intent.canceled', 'payment_intent.requires_action'):
-            payment_intent = event.data.object
-            tasks.update_from_payment_intent(payment_intent)
-        elif event.type in ('source.failed', 'source.chargeable', 'source.canceled'):
-            source = event.data.object
-            tasks.update_from_source(source)
-        elif event.type in ('charge.pending', 'charge.succeeded', 'charge.failed', 'charge.succeeded',
-                            'charge.refunded'):
-            charge = event.data.object
-            tasks.update_from_charge(charge)
-        elif event.type == "charge.refund.updated":
-            refund = event.data.object
-            tasks.update_from_stripe_refund(refund)
-        elif event.type in ("checkout.session.completed", "checkout.session.async_payment_failed",
-                            "checkout.session.async_payment_succeeded"):
-            session = event.data.object
-            tasks.update_from_checkout_session(session)
-        elif event.type == "setup_intent.succeeded":
-            session = event.data.object
-            tasks.setup_intent_succeeded(session)
-        elif event.type == "cash_balance.funds_available":
-            balance_transaction = event.data.object
-            tasks.balance_funded(balance_transaction)
-        elif event.type == "mandate.updated":
-            mandate = event.data.object
-            tasks.mandate_update(mandate)
-        else:
-            return HttpResponseBadRequest()
+    if event.type not in STRIPE_EVENT_TYPES:
+        return HttpResponseBadRequest()
+
+    models.WebhookEvent.ingest(
+        models.WebhookEvent.PROVIDER_STRIPE, event.id, event.data.object.get("id", event.id), json.loads(payload)
+    )
+    return HttpResponse(status=200)
+
 
-        return HttpResponse(status=200)
+def process_stripe_event(payload):
+    event = stripe.Event.construct_from(payload, stripe.api_key)
+
+    if event.type in ('payment_intent.succeeded', 'payment_intent.payment_failed', 'payment_intent.processing',
+                      'payment_intent.canceled', 'payment_intent.requires_action'):
+        payment_intent = event.data.object
+        tasks.update_from_payment_intent(payment_intent)
+    elif event.type in ('source.failed', 'source.chargeable', 'source.canceled'):
+        source = event.data.object
+        tasks.update_from_source(source)
+    elif event.type in ('charge.pending', 'charge.succeeded', 'charge.failed', 'charge.succeeded',
+                        'charge.refunded'):
+        charge = event.data.object
+        tasks.update_from_charge(charge)
+    elif event.type == "charge.refund.updated":
+        refund = event.data.object
+        tasks.update_from_stripe_refund(refund)
+    elif event.type in ("checkout.session.completed", "checkout.session.async_payment_failed",
+                        "checkout.session.async_payment_succeeded"):
+        session = event.data.object
+        tasks.update_from_checkout_session(session)
+    elif event.type == "setup_intent.succeeded":
+        session = event.data.object
+        tasks.setup_intent_succeeded(session)
+    elif event.type == "cash_balance.funds_available":
+        balance_transaction = event.data.object
+        tasks.balance_funded(balance_transaction)
+    elif event.type == "mandate.updated":
+        mandate = event.data.object
+        tasks.mandate_update(mandate)
 
 
 @csrf_exempt
@@ -130,33 +149,65 @@ def gc_webhook(request):
         return HttpResponseBadRequest()
 
     for event in events["events"]:
-        with transaction.atomic():
-            if event["resource_type"] == "payments":
-                tasks.update_from_gc_payment(event["links"]["payment"], None)
-            if event["resource_type"] == "billing_requests":
-                tasks.update_from_gc_billing_request(event["links"]["billing_request"], None)
-            elif event["resource_type"] == "mandates":
-                scheme = event["details"].get("scheme")
-                if scheme == "ach":
-                    models.ACHMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme == "autogiro":
-                    models.AutogiroMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme == "bacs":
-                    models.GCBACSMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme == "becs":
-                    models.BECSMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme == "becs_nz":
-                    models.BECSNZMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme == "betalingsservice":
-                    models.BetalingsserviceMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme == "pad":
-                    models.PADMandate.sync_mandate(event["links"]["mandate"], None)
-                elif scheme in ("sepa_core", "sepa_cor1"):
-                    models.GCSEPAMandate.sync_mandate(event["links"]["mandate"], None)
+        models.WebhookEvent.ingest(
+            models.WebhookEvent.PROVIDER_GOCARDLESS, event["id"], gc_resource_id(event), event
+        )
 
     return HttpResponse(status=204)
 
 
+GC_RESOURCE_LINKS = {
+    "payments": "payment",
+    "billing_requests": "billing_request",
+    "mandates": "mandate",
+}
+
+
+def gc_resource_id(event):
+    link = GC_RESOURCE_LINKS.get(event["resource_type"])
+    if link and link in event["links"]:
+        return event["links"][link]
+    return next(iter(event["links"].values()), event["id"])
+
+
+def process_gc_events(events):
+    # Each handler re-reads the resource from GoCardless, so only the newest event per resource needs applying
+    latest = {}
+    for event in events:
+        if event["resource_type"] in GC_RESOURCE_LINKS:
+            latest[(event["resource_type"], gc_resource_id(event))] = event
+        else:
+            latest[event["id"]] = event
+
+    for event in latest.values():
+        process_gc_event(event)
+
+
+def process_gc_event(event):
+    if event["resource_type"] == "payments":
+        tasks.update_from_gc_payment(event["links"]["payment"], None)
+    if event["resource_type"] == "billing_requests":
+        tasks.update_from_gc_billing_request(event["links"]["billing_request"], None)
+    elif event["resource_type"] == "mandates":
+        scheme = event["details"].get("scheme")
+        if scheme == "ach":
+            models.ACHMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme == "autogiro":
+            models.AutogiroMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme == "bacs":
+            models.GCBACSMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme == "becs":
+            models.BECSMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme == "becs_nz":
+            models.BECSNZMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme == "betalingsservice":
+            models.BetalingsserviceMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme == "pad":
+            models.PADMandate.sync_mandate(event["links"]["mandate"], None)
+        elif scheme in ("sepa_core", "sepa_cor1"):
+            models.GCSEPAMandate.sync_mandate(event["links"]["mandate"], None)
+
+
 def attempt_complete_bank_transfer(
         ref: typing.Optional[str], amount: decimal.Decimal, trans_account_data: dict, data=None,
         ledger_item=None, known_account=None, override_country_check: bool = False,
@@ -166,15 +217,7 @@ def attempt_complete_bank_transfer(
 
     if ref or ledger_item:
         if not ledger_item:
-            normalised_ref = ref.upper().replace(" ", "").replace("\n", "")
-            ledger_items = models.LedgerItem.objects.filter(
-                type=models.LedgerItem.TYPE_BACS,
-                state=models.LedgerItem.STATE_PENDING
-            )
-            for poss_ledger_item in ledger_items:
-                if poss_ledger_item.type_id in normalised_ref:
-                    ledger_item = poss_ledger_item
-                    break
+            ledger_item = bank_refs.matcher.match(ref)
 
         if (trans_account_data or override_country_check) and ledger_item:
             if trans_account_data:
@@ -279,6 +322,15 @@ def xfw_webhook(request):
     if is_test and is_test.lower() == "true":
         return HttpResponse(status=204)
 
+    if event.get("event_type") == "balances#credit":
+        event_id = request.META.get('HTTP_X_DELIVERY_ID') or hashlib.sha256(payload).hexdigest()
+        # Credits don't depend on each other, so each is ordered on its own and one failing doesn't hold back the rest
+        models.WebhookEvent.ingest(models.WebhookEvent.PROVIDER_WISE, event_id, event_id, event)
+
+    return HttpResponse(status=204)
+
+
+def process_wise_event(event):
     if event.get("event_type") == "balances#credit":
         profile_id = event["data"]["resource"]["profile_id"]
         account_id = event["data"]["resource"]["id"]
@@ -339,8 +391,6 @@ def xfw_webhook(request):
             
             attempt_complete_bank_transfer(ref, amount, trans_account_data, data=found_t)
 
-    return HttpResponse(status=204)
-
 
 @csrf_exempt
 @require_POST
@@ -355,37 +405,42 @@ def monzo_webhook(request, secret_key):
 
     if payload.get("type") == 'transaction.created':
         data = payload.get("data")
-        ref = data.get("metadata", {}).get("notes")
-        amount = decimal.Decimal(data.get("amount")) / decimal.Decimal(100)
-        if amount > 0:
-            trans_account_data = None
+        models.WebhookEvent.ingest(models.WebhookEvent.PROVIDER_MONZO, data["id"], data["id"], payload)
+    else:
+        return HttpResponseBadRequest()
 
-            if "counterparty" in data:
-                if "iban" in data["counterparty"]:
-                    try:
-                        trans_iban = schwifty.IBAN(data["counterparty"]["iban"])
-                        trans_account_data = {
-                            "country_code": trans_iban.country_code.lower(),
-                            "bank_code": trans_iban.bank_code,
-                            "branch_code": trans_iban.branch_code,
-                            "account_code": trans_iban.account_code
-                        }
-                    except ValueError:
-                        pass
-                elif "account_number" in data["counterparty"] and "sort_code" in data["counterparty"]:
+    return HttpResponse(status=200)
+
+
+def process_monzo_event(payload):
+    data = payload.get("data")
+    ref = data.get("metadata", {}).get("notes")
+    amount = decimal.Decimal(data.get("amount")) / decimal.Decimal(100)
+    if amount > 0:
+        trans_account_data = None
+
+        if "counterparty" in data:
+            if "iban" in data["counterparty"]:
+                try:
+                    trans_iban = schwifty.IBAN(data["counterparty"]["iban"])
                     trans_account_data = {
-                        "country_code": "gb",
-                        "bank_code": "",
-                        "branch_code": data["counterparty"]["sort_code"],
-                        "account_code": data["counterparty"]["account_number"],
+                        "country_code": trans_iban.country_code.lower(),
+                        "bank_code": trans_iban.bank_code,
+                        "branch_code": trans_iban.branch_code,
+                        "account_code": trans_iban.account_code
                     }
+                except ValueError:
+                    pass
+            elif "account_number" in data["counterparty"] and "sort_code" in data["counterparty"]:
+                trans_account_data = {
+                    "country_code": "gb",
+                    "bank_code": "",
+                    "branch_code": data["counterparty"]["sort_code"],
+                    "account_code": data["counterparty"]["account_number"],
+                }
 
-            attempt_complete_bank_transfer(ref, amount, trans_account_data, data=data)
-
-    else:
-        return HttpResponseBadRequest()
+        attempt_complete_bank_transfer(ref, amount, trans_account_data, data=data)
 
-    return HttpResponse(status=200)
 
 @csrf_exempt
 @require_POST
@@ -405,8 +460,67 @@ def coinbase_webhook(request):
         return HttpResponseBadRequest()
 
     if event["event"]["type"].startswith("charge:"):
-        tasks.update_from_coinbase_charge(event["event"]["data"])
+        models.WebhookEvent.ingest(
+            models.WebhookEvent.PROVIDER_COINBASE, event["event"]["id"],
+            event["event"]["data"].get("code", event["event"]["id"]), event
+        )
     else:
         return HttpResponseBadRequest()
 
-    return HttpResponse(status=200)
\ No newline at end of file
+    return HttpResponse(status=200)
+
+
+def process_coinbase_event(event):
+    tasks.update_from_coinbase_charge(event["event"]["data"])
+
+
+WEBHOOK_PROCESSORS = {
+    models.WebhookEvent.PROVIDER_STRIPE: process_stripe_event,
+    models.WebhookEvent.PROVIDER_GOCARDLESS: process_gc_event,
+    models.WebhookEvent.PROVIDER_WISE: process_wise_event,
+    models.WebhookEvent.PROVIDER_MONZO: process_monzo_event,
+    models.WebhookEvent.PROVIDER_COINBASE: process_coinbase_event,
+}
+
+
+WEBHOOK_BATCH_PROCESSORS = {
+    models.WebhookEvent.PROVIDER_GOCARDLESS: process_gc_events,
+}
+
+
+def process_webhook_event(webhook_event_id) -> bool:
+    try:
+        with transaction.atomic():
+            webhook_event = models.WebhookEvent.objects.select_for_update().get(id=webhook_event_id)
+            if webhook_event.state != models.WebhookEvent.STATE_PENDING:
+                return True
+            WEBHOOK_PROCESSORS[webhook_event.provider](webhook_event.payload)
+            webhook_event.mark_processed()
+            return True
+    except Exception:
+        error = traceback.format_exc()
+        with transaction.atomic():
+            webhook_event = models.WebhookEvent.objects.select_for_update().get(id=webhook_event_id)
+            webhook_event.mark_failed(error)
+        return False
+
+
+def process_webhook_batch(provider, webhook_event_ids) -> bool:
+    try:
+        with transaction.atomic():
+            webhook_events = list(models.WebhookEvent.objects.select_for_update().filter(
+                id__in=webhook_event_ids, state=models.WebhookEvent.STATE_PENDING
+            ).order_by('received_at'))
+            if webhook_events:
+                WEBHOOK_BATCH_PROCESSORS[provider]([e.payload for e in webhook_events])
+                for webhook_event in webhook_events:
+                    webhook_event.mark_processed()
+            return True
+    except Exception:
+        error = traceback.format_exc()
+        with transaction.atomic():
+            for webhook_event in models.WebhookEvent.objects.select_for_update().filter(
+                id__in=webhook_event_ids, state=models.WebhookEvent.STATE_PENDING
+            ):
+                webhook_event.mark_failed(error)
+        return False